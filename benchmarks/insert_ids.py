@@ -0,0 +1,67 @@
+"""
+Benchmark message inserts with per-message id allocation (one counters round
+trip per message) against block allocation (ChatMessagesHandler.allocate_ids).
+
+Run against a local mongod from the repo root:
+
+    python -m benchmarks.insert_ids --uri mongodb://localhost:27017 --batch 500 --batches 20
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime as dt
+
+from mongo_connect import ChatMessagesHandler
+
+
+def make_batch(size, vid_id="bench"):
+    return [{
+        "vid_id": vid_id,
+        "author": "bench",
+        "author_id": "bench",
+        "dt_stamp": dt.now(),
+        "msg_id": uuid.uuid4().hex,
+        "message": "benchmark message",
+    } for _ in range(size)]
+
+
+def insert_per_message(handler, data):
+    # The original insert path: one find_one_and_update per message
+    messages_to_insert = []
+    for item in data:
+        id = handler.get_next_sequence_value('message_id')
+        messages_to_insert.append({"id": id, **item, "enriched": False})
+    handler.db.messages.insert_many(messages_to_insert)
+
+
+def run(label, insert, batch, batches):
+    total = 0
+    start = time.perf_counter()
+    for _ in range(batches):
+        data = make_batch(batch)
+        insert(data)
+        total += len(data)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {total} msgs in {elapsed:.2f}s -> {total / elapsed:,.0f} inserts/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="chat_messages_bench")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--batches", type=int, default=20)
+    args = parser.parse_args()
+
+    handler = ChatMessagesHandler(uri=args.uri)
+    handler.db = handler.client[args.db]
+    handler.create_msg_index()
+
+    run("per-message", lambda data: insert_per_message(handler, data), args.batch, args.batches)
+    run("block", handler.insert_messages, args.batch, args.batches)
+
+    handler.client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Measure SpillingIngestBuffer under a simulated database outage: messages are
+submitted at a steady rate while, for part of the run, the handler points at an
+unreachable server. Reports submit throughput and latency (submits should not
+stall during the outage), how much was spilled to disk, the time from the end of
+the outage until the backlog is fully written, and whether every message arrived.
+Nothing should be quarantined: an outage, however long, is not a bad record.
+
+Run against a local mongod from the repo root:
+
+    python -m benchmarks.outage --uri mongodb://localhost:27017 --messages 5000 --rate 500 --outage-start 2 --outage-seconds 5
+    # Outage well past max_attempts retries (about 5 s at --retry-interval 1)
+    python -m benchmarks.outage --uri mongodb://localhost:27017 --messages 15000 --rate 500 --outage-start 2 --outage-seconds 20
+"""
+import argparse
+import tempfile
+import time
+
+from pymongo import MongoClient
+
+from benchmarks.replay import percentile, synthetic_burst
+from collector import normalise_chat_message
+from ingest_buffer import SpillingIngestBuffer
+from mongo_connect import ChatMessagesHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="chat_messages_bench")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=500, help="Messages submitted per second")
+    parser.add_argument("--submit-batch", type=int, default=200, help="Messages per submit, like a collector flush")
+    parser.add_argument("--outage-start", type=float, default=2, help="Seconds into the run the outage begins")
+    parser.add_argument("--outage-seconds", type=float, default=5, help="Outage length; 0 for a baseline run")
+    parser.add_argument("--max-memory", type=int, default=10000)
+    parser.add_argument("--retry-interval", type=float, default=1)
+    args = parser.parse_args()
+
+    handler = ChatMessagesHandler(uri=args.uri)
+    handler.db = handler.client[args.db]
+    handler.client.drop_database(args.db)
+    handler.create_msg_index()
+    live_db = handler.db
+    # Nothing listens on port 1; short timeouts keep each failed write brief
+    dead_db = MongoClient("mongodb://localhost:1", serverSelectionTimeoutMS=200, connectTimeoutMS=200)[args.db]
+
+    msgs = [normalise_chat_message(item, "outage") for item in synthetic_burst(args.messages, args.messages / args.rate)]
+    spill_dir = tempfile.mkdtemp(prefix="ingest-spill-")
+    buffer = SpillingIngestBuffer(handler, spill_dir, max_memory=args.max_memory, retry_interval=args.retry_interval)
+
+    submit_latencies = []
+    outage_end = None
+    start = time.perf_counter()
+    for i in range(0, len(msgs), args.submit_batch):
+        elapsed = time.perf_counter() - start
+        if args.outage_seconds and outage_end is None:
+            if args.outage_start <= elapsed < args.outage_start + args.outage_seconds:
+                handler.db = dead_db
+            elif elapsed >= args.outage_start + args.outage_seconds and handler.db is dead_db:
+                handler.db = live_db
+                outage_end = time.perf_counter()
+        target = start + i / args.rate
+        if target > time.perf_counter():
+            time.sleep(target - time.perf_counter())
+        t = time.perf_counter()
+        buffer.submit(msgs[i:i + args.submit_batch])
+        submit_latencies.append(time.perf_counter() - t)
+    submit_elapsed = time.perf_counter() - start
+
+    if args.outage_seconds and outage_end is None:
+        # The run was shorter than the outage window
+        time.sleep(max(0, start + args.outage_start + args.outage_seconds - time.perf_counter()))
+        handler.db = live_db
+        outage_end = time.perf_counter()
+
+    while buffer.pending():
+        time.sleep(0.05)
+    drained = time.perf_counter()
+    buffer.close()
+
+    stored = live_db.messages.count_documents({"vid_id": "outage"})
+    print(f"submitted {len(msgs)} msgs in {submit_elapsed:.2f}s -> {len(msgs) / submit_elapsed:,.0f} msgs/s, "
+          f"submit p50 {percentile(submit_latencies, 50) * 1000:.2f}ms, "
+          f"p99 {percentile(submit_latencies, 99) * 1000:.2f}ms, max {max(submit_latencies) * 1000:.2f}ms")
+    print(f"spilled {buffer.counters['spilled']}, replayed {buffer.counters['replayed']}, "
+          f"duplicates {buffer.counters['duplicates']}, quarantined {buffer.counters['quarantined']}")
+    if outage_end is not None:
+        print(f"recovery: backlog written {drained - outage_end:.2f}s after the outage ended")
+    print(f"stored {stored}/{len(msgs)}{'' if stored == len(msgs) else ' -- MESSAGES LOST'}")
+    if buffer.counters["quarantined"]:
+        print(f"quarantined {buffer.counters['quarantined']} messages during an outage -- see {spill_dir}/quarantine.log")
+
+    handler.client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()
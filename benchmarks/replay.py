@@ -0,0 +1,165 @@
+"""
+Replay recorded live chat through the collector's ingest path (normalise_chat_message
+-> micro-batches -> ChatMessagesHandler.insert_messages) and report throughput,
+batch latency and MongoDB round trips per message.
+
+Recordings are JSONL in the chat_downloader message shape, one message per line
+(message_id, message, timestamp in microseconds, author {name, id}). Without --file
+a synthetic burst is replayed instead (by default 5,000 messages in 10 seconds).
+
+Run against a local mongod from the repo root:
+
+    python -m benchmarks.replay --uri mongodb://localhost:27017 --file chat.jsonl --speed 1 10 max
+    python -m benchmarks.replay --uri mongodb://localhost:27017 --burst 5000 --burst-seconds 10 --max-p99-ms 250
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+
+from pymongo import monitoring
+
+from collector import normalise_chat_message
+from mongo_connect import ChatMessagesHandler
+
+SAMPLE_MESSAGES = [
+    "hello everyone", "lol", "Majulah Singapura!", "NS is a waste of time honestly",
+    "good evening from Tampines", "harga barang naik lagi", "大家好", "what did the minister say just now",
+    "SAF did well this year", "housing is too expensive for young couples", "hahaha", "wah so many people",
+]
+
+
+class CommandCounter(monitoring.CommandListener):
+    # Counts every command sent to the server, i.e. network round trips
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def load_recording(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_burst(count=5000, seconds=10, start=None, seed=0):
+    # chat_downloader-shaped messages, spread at random over `seconds`
+    rng = random.Random(seed)
+    start = start if start is not None else time.time()
+    offsets = sorted(rng.uniform(0, seconds) for _ in range(count))
+    return [{
+        "message_id": uuid.UUID(int=rng.getrandbits(128)).hex,
+        "message": f"{rng.choice(SAMPLE_MESSAGES)} #{i}",
+        "timestamp": int((start + offset) * 1_000_000),
+        "time_in_seconds": offset,
+        "author": {"name": f"viewer{rng.randrange(500)}", "id": f"UC{rng.randrange(500):06d}"},
+    } for i, offset in enumerate(offsets)]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def replay(handler, items, vid_id="replay", speed=None, max_batch=200, max_delay=2.0):
+    # speed is a multiple of real time (1, 10, ...) or None to insert as fast as possible;
+    # batches are flushed by size and age the same way StreamWorker does
+    latencies = []
+    inserted = 0
+    batch = []
+    batch_since = None
+
+    def flush():
+        nonlocal batch, batch_since, inserted
+        if batch:
+            start = time.perf_counter()
+            inserted += handler.insert_messages(batch) or 0
+            latencies.append(time.perf_counter() - start)
+        batch, batch_since = [], None
+
+    first_ts = items[0]["timestamp"] if items else 0
+    start = time.perf_counter()
+    for item in items:
+        if speed:
+            target = start + (item["timestamp"] - first_ts) / 1_000_000 / speed
+            while True:
+                now = time.perf_counter()
+                if batch_since is not None and now - batch_since >= max_delay:
+                    flush()
+                wait = target - now
+                if wait <= 0:
+                    break
+                time.sleep(min(wait, max_delay - (now - batch_since)) if batch_since is not None else wait)
+        if not batch:
+            batch_since = time.perf_counter()
+        batch.append(normalise_chat_message(item, vid_id))
+        if len(batch) >= max_batch:
+            flush()
+    flush()
+    elapsed = time.perf_counter() - start
+    return {"messages": len(items), "inserted": inserted, "batches": len(latencies), "elapsed": elapsed,
+            "latencies": latencies}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="chat_messages_bench")
+    parser.add_argument("--file", help="Recorded chat (JSONL, chat_downloader message shape)")
+    parser.add_argument("--burst", type=int, default=5000, help="Synthetic messages when no --file is given")
+    parser.add_argument("--burst-seconds", type=float, default=10, help="Seconds the synthetic burst spans")
+    parser.add_argument("--save", help="Write the synthetic burst to this JSONL file and exit")
+    parser.add_argument("--speed", nargs="+", default=["max"], help="Replay rates: multiples of real time or 'max'")
+    parser.add_argument("--max-batch", type=int, default=200)
+    parser.add_argument("--max-delay", type=float, default=2.0)
+    parser.add_argument("--max-p99-ms", type=float, help="Exit non-zero if any run's p99 batch latency is above this")
+    args = parser.parse_args()
+
+    items = load_recording(args.file) if args.file else synthetic_burst(args.burst, args.burst_seconds)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(item, ensure_ascii=False) + "\n" for item in items)
+        print(f"Wrote {len(items)} messages to {args.save}")
+        return
+
+    # Listeners only apply to clients created after they are registered
+    counter = CommandCounter()
+    monitoring.register(counter)
+    handler = ChatMessagesHandler(uri=args.uri)
+    handler.db = handler.client[args.db]
+
+    slow = False
+    for speed in args.speed:
+        handler.client.drop_database(args.db)
+        handler.create_msg_index()
+        counter.count = 0
+        stats = replay(handler, items, speed=None if speed == "max" else float(speed),
+                       max_batch=args.max_batch, max_delay=args.max_delay)
+        p50 = percentile(stats["latencies"], 50) * 1000
+        p99 = percentile(stats["latencies"], 99) * 1000
+        label = "max" if speed == "max" else f"{speed}x"
+        print(f"{label:<6} {stats['inserted']}/{stats['messages']} msgs in {stats['elapsed']:.2f}s "
+              f"-> {stats['messages'] / stats['elapsed']:,.0f} msgs/s, {stats['batches']} batches, "
+              f"p50 {p50:.1f}ms, p99 {p99:.1f}ms, {counter.count / max(1, stats['messages']):.3f} round trips/msg")
+        if args.max_p99_ms is not None and p99 > args.max_p99_ms:
+            slow = True
+
+    handler.client.drop_database(args.db)
+    if slow:
+        sys.exit(f"p99 batch latency above {args.max_p99_ms}ms")
+
+
+if __name__ == "__main__":
+    main()
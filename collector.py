@@ -0,0 +1,221 @@
+from chat_downloader import ChatDownloader
+from datetime import datetime as dt
+from pymongo.errors import PyMongoError
+import argparse
+import logging
+import threading
+import time
+
+from ingest_buffer import SpillingIngestBuffer
+from mongo_connect import ChatMessagesHandler, parse_video_id
+
+
+def normalise_chat_message(item, vid_id):
+    # chat_downloader message -> the shape insert_messages expects
+    author = item.get("author") or {}
+    return {
+        "vid_id": vid_id,
+        "author": author.get("name"),
+        "author_id": author.get("id"),
+        "dt_stamp": dt.fromtimestamp(item["timestamp"] / 1_000_000),
+        "msg_id": item["message_id"],
+        "message": item.get("message") or "",
+        # Position in a replay, kept for the collection checkpoint
+        "time_in_seconds": item.get("time_in_seconds"),
+    }
+
+
+class StreamWorker(threading.Thread):
+    """
+    Follows one live chat and micro-batches its messages into the database: a batch
+    is flushed as soon as it holds max_batch messages, or by the collector once it
+    is older than max_delay seconds. Memory per stream is bounded by max_batch.
+    """
+
+    def __init__(self, handler: ChatMessagesHandler, url, max_batch=200, max_delay=2.0,
+                 ingest_buffer: SpillingIngestBuffer = None):
+        super().__init__(name=f"stream-{url}", daemon=True)
+        self.handler = handler
+        self.ingest_buffer = ingest_buffer
+        self.url = url
+        self.vid_id = parse_video_id(url)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.downloader = ChatDownloader()
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffer_since = None
+        # Newest durable message and the count not yet added to the checkpoint, see save_checkpoint
+        self.durable = None
+        self.durable_count = 0
+
+    def run(self):
+        try:
+            # Resume from the last flushed message instead of re-ingesting history:
+            # replays seek to it, live chats skip anything up to it
+            checkpoint = self.handler.get_checkpoint(self.url) or {}
+            skip_before = checkpoint.get("last_dt_stamp")
+            skip_msg_id = checkpoint.get("last_msg_id")
+            chat_kwargs = {}
+            if checkpoint.get("last_time_in_seconds") is not None:
+                chat_kwargs["start_time"] = checkpoint["last_time_in_seconds"]
+            chat = self.downloader.get_chat(self.url, message_types=['text_message'], **chat_kwargs)
+            for item in chat:
+                if self.stop_event.is_set():
+                    break
+                if skip_before is not None:
+                    if item["message_id"] == skip_msg_id or dt.fromtimestamp(item["timestamp"] / 1_000_000) < skip_before:
+                        continue
+                    skip_before = None
+                with self.lock:
+                    if not self.buffer:
+                        self.buffer_since = time.monotonic()
+                    self.buffer.append(normalise_chat_message(item, self.vid_id))
+                    full = len(self.buffer) >= self.max_batch
+                if full:
+                    self.flush()
+        except Exception as e:
+            if not self.stop_event.is_set():
+                logging.error(f"Chat for {self.url} stopped: {e}")
+        finally:
+            self.flush()
+            logging.info(f"Stopped collecting {self.url}.")
+
+    def flush(self):
+        with self.lock:
+            batch, self.buffer, self.buffer_since = self.buffer, [], None
+        if batch:
+            if self.ingest_buffer is not None:
+                # The checkpoint only moves once the buffer has the batch in the database or on disk
+                self.ingest_buffer.submit(batch, on_commit=lambda: self._committed(batch, len(batch)))
+            else:
+                counts = self.handler.ingest_messages(batch)
+                if counts["failed"] < len(batch):
+                    self._committed(batch, counts["inserted"])
+        self.save_checkpoint()
+
+    def _committed(self, batch, inserted):
+        # Callbacks can arrive out of order (spilled batches commit at once), keep the newest
+        with self.lock:
+            if self.durable is None or batch[-1]["dt_stamp"] >= self.durable["dt_stamp"]:
+                self.durable = batch[-1]
+            self.durable_count += inserted
+
+    def save_checkpoint(self):
+        # Skipped while the buffer is riding out an outage; the next flush catches up
+        if self.ingest_buffer is not None and not self.ingest_buffer.healthy:
+            return
+        with self.lock:
+            last, count = self.durable, self.durable_count
+            self.durable, self.durable_count = None, 0
+        if last is None:
+            return
+        try:
+            self.handler.save_checkpoint(self.url, last["dt_stamp"], last["msg_id"], count,
+                                         last["time_in_seconds"])
+        except PyMongoError as e:
+            logging.warning(f"Could not save the checkpoint for {self.url}: {e}")
+            with self.lock:
+                # Keep the newer durable position if one arrived meanwhile
+                self.durable = self.durable or last
+                self.durable_count += count
+
+    def flush_if_due(self):
+        with self.lock:
+            due = self.buffer_since is not None and time.monotonic() - self.buffer_since >= self.max_delay
+        if due:
+            self.flush()
+        else:
+            # Batches the ingest buffer committed since the last flush
+            self.save_checkpoint()
+
+    def stop(self):
+        self.stop_event.set()
+        # Unblocks a worker waiting on the chat's next poll
+        self.downloader.close()
+
+
+class Collector:
+    """
+    Runs one StreamWorker per collection URL with status "start". Every
+    poll_interval seconds it re-reads the collection and service status, starting
+    and stopping workers as URLs are started/stopped in the Collection Center, and
+    stops everything while the service status is "stopped".
+    """
+
+    def __init__(self, handler: ChatMessagesHandler, max_batch=200, max_delay=2.0, poll_interval=5, restart_delay=60,
+                 ingest_buffer: SpillingIngestBuffer = None):
+        self.handler = handler
+        self.ingest_buffer = ingest_buffer
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.restart_delay = restart_delay
+        self.workers = {}
+        self.last_started = {}
+        self.invalid_urls = set()
+
+    def sync(self):
+        # Bring the running workers in line with the database
+        self.handler.invalidate_cache("collection", "service")
+        running = self.handler.get_service_status() != "stopped"
+        wanted = set(self.handler.collection_start_status() or []) if running else set()
+        for url in wanted - self.invalid_urls:
+            if parse_video_id(url) is None:
+                logging.error(f"No YouTube video id in {url}, not collecting it.")
+                self.invalid_urls.add(url)
+        wanted -= self.invalid_urls
+
+        for url in list(self.workers):
+            worker = self.workers[url]
+            if url not in wanted:
+                worker.stop()
+                del self.workers[url]
+            elif not worker.is_alive():
+                # Stream ended or failed; it gets restarted below after restart_delay
+                del self.workers[url]
+
+        for url in wanted - set(self.workers):
+            if time.monotonic() - self.last_started.get(url, -self.restart_delay) < self.restart_delay:
+                continue
+            worker = StreamWorker(self.handler, url, self.max_batch, self.max_delay, self.ingest_buffer)
+            worker.start()
+            self.workers[url] = worker
+            self.last_started[url] = time.monotonic()
+            logging.info(f"Started collecting {url}.")
+
+    def run_forever(self):
+        last_sync = 0
+        while True:
+            if time.monotonic() - last_sync >= self.poll_interval:
+                try:
+                    self.sync()
+                except PyMongoError as e:
+                    # Keep the running streams going through a database outage
+                    logging.error(f"Could not read the collection status: {e}")
+                last_sync = time.monotonic()
+            for worker in list(self.workers.values()):
+                worker.flush_if_due()
+            time.sleep(min(self.max_delay, self.poll_interval) / 4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect live chat for every started collection URL.")
+    parser.add_argument("--max-batch", type=int, default=200, help="Messages per insert")
+    parser.add_argument("--max-delay", type=float, default=2.0, help="Seconds before a partial batch is flushed")
+    parser.add_argument("--poll-interval", type=float, default=5, help="Seconds between collection status checks")
+    parser.add_argument("--uri", default=None, help="MongoDB URI (defaults to the configured Atlas cluster)")
+    parser.add_argument("--spill-dir", default=None,
+                        help="Buffer writes through this directory while the database is slow or unreachable")
+    args = parser.parse_args()
+
+    handler = ChatMessagesHandler(uri=args.uri)
+    ingest_buffer = SpillingIngestBuffer(handler, args.spill_dir) if args.spill_dir else None
+    collector = Collector(handler, max_batch=args.max_batch, max_delay=args.max_delay,
+                          poll_interval=args.poll_interval, ingest_buffer=ingest_buffer)
+    try:
+        collector.run_forever()
+    finally:
+        if ingest_buffer is not None:
+            ingest_buffer.close()
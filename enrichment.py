@@ -0,0 +1,220 @@
+from openai import OpenAI, APIConnectionError, RateLimitError
+from pydantic import BaseModel, ValidationError
+from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Literal
+from datetime import datetime as dt, timedelta
+from pymongo import ASCENDING, DESCENDING
+import argparse
+import backoff
+import json
+import logging
+import os
+import socket
+import time
+import streamlit as st
+
+from mongo_connect import ChatMessagesHandler, EnrichmentUpdate, parse_video_id
+from preclassifier import PreClassifier
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+config = ConfigParser()
+try:
+    config.read(os.path.join(script_dir, 'config.ini'))
+    api_key = config['OPENAI']['api_key']
+except KeyError: # If the key is not found in the config file
+    api_key = st.secrets['OPENAI']['api_key']
+
+Stance = Literal['Favor', 'Against', 'Neutral', 'NA']
+
+
+class MessageLabels(BaseModel):
+    # Mirrors mongo_connect.EnrichmentUpdate, with the codebook's label values
+    id: int
+    sg: Stance
+    mil: Stance
+    rnr: Stance
+    lang: Literal['EN', 'MS', 'ZH', 'TA', 'Other']
+    troll: bool
+    toxic: bool
+    senti: Literal['Pos', 'Neut', 'Neg']
+    societal_impact: Stance
+
+
+class BatchLabels(BaseModel):
+    labels: List[MessageLabels]
+
+
+system_message = """You label live chat comments from Singapore-related YouTube streams, following this codebook:
+
+- lang: main language of the comment: EN, MS (Malay), ZH (Chinese), TA (Tamil) or Other. For mixed languages pick the majority.
+- troll: true if the comment is intentionally provocative or disruptive (deliberate misreading, excessive mockery, extreme views to provoke, irrelevant spam).
+- toxic: true if the comment contains personal attacks, hate speech, threats, extremely vulgar language or deliberate misinformation.
+- senti: overall tone: Pos, Neut or Neg.
+- sg: stance on Singapore's governance, policies or national issues.
+- mil: stance on Singapore military matters (SAF, National Service, MINDEF, defence spending and cooperation).
+- rnr: stance on race and religion in Singapore (harmony policies, integration, discrimination, religious freedom).
+- societal_impact: stance on significant social issues, norms or policy change; NA for personal or trivial comments.
+
+Stances are Favor, Against, Neutral, or NA when the topic is not addressed.
+
+You receive a JSON list of {"id", "message"} objects. Reply with a JSON object {"labels": [...]} holding exactly one entry per input id with the fields id, lang, troll, toxic, senti, sg, mil, rnr, societal_impact."""
+
+
+class BacklogScheduler:
+    """
+    Decides which unenriched messages a worker claims next: messages from streams
+    being collected right now (status "start"), newest first, ahead of the rest.
+    A share of every claim goes to messages that have waited longer than max_wait
+    (oldest first), so the backlog of stopped streams still drains.
+    """
+
+    def __init__(self, handler: ChatMessagesHandler, max_wait=600, aged_share=0.25):
+        self.handler = handler
+        self.max_wait = max_wait
+        self.aged_share = aged_share
+
+    def active_video_ids(self):
+        urls = self.handler.collection_start_status() or []
+        return [vid_id for vid_id in map(parse_video_id, urls) if vid_id]
+
+    def claim(self, worker_id, limit, lease_seconds=300):
+        aged_before = dt.now() - timedelta(seconds=self.max_wait)
+        claimed = self.handler.claim_messages(
+            worker_id, max(1, int(limit * self.aged_share)), lease_seconds,
+            query={"dt_stamp": {"$lt": aged_before}}, sort=ASCENDING
+        )
+        active = self.active_video_ids()
+        if active:
+            claimed += self.handler.claim_messages(
+                worker_id, limit - len(claimed), lease_seconds,
+                query={"vid_id": {"$in": active}}, sort=DESCENDING
+            )
+        claimed += self.handler.claim_messages(worker_id, limit - len(claimed), lease_seconds, sort=DESCENDING)
+        return claimed
+
+    def metrics(self):
+        # Backlog depth and oldest-pending age per video, flagging active streams
+        active = set(self.active_video_ids())
+        return [{**row, "active": row["vid_id"] in active} for row in self.handler.get_backlog_stats()]
+
+
+class EnrichmentWorker:
+    """
+    Drains unenriched messages from MongoDB and labels them with the LLM, K messages
+    per request and several requests in flight, writing each batch back with
+    update_msg_enrichment_many.
+    """
+
+    def __init__(self, handler: ChatMessagesHandler, openai_client=None, model="gpt-4o", batch_size=20, concurrency=4,
+                 lease_seconds=300, attempts=2):
+        self.handler = handler
+        # Claims are leased to this worker, so several workers can drain the same queue
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.attempts = attempts
+        # Keep a batch's LLM time (attempts x (retries + one request)) well inside its
+        # lease; writes are fenced on the claim anyway, so an overrun only wastes the call
+        self.request_timeout = lease_seconds / 10
+        self.retry_seconds = lease_seconds / (4 * attempts)
+        self._complete = backoff.on_exception(
+            backoff.expo, (APIConnectionError, RateLimitError), max_time=self.retry_seconds
+        )(self._complete)
+        self.scheduler = BacklogScheduler(handler)
+        self.preclassifier = PreClassifier(handler)
+        self.openai_client = openai_client or OpenAI(api_key=api_key, max_retries=0)
+        self.model = model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+    def _complete(self, msgs):
+        # Retried with backoff for up to retry_seconds, see __init__
+        response = self.openai_client.chat.completions.create(
+            model=self.model, temperature=0, timeout=self.request_timeout,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": json.dumps(
+                    [{"id": msg["id"], "message": msg["message"]} for msg in msgs], ensure_ascii=False
+                )}
+            ]
+        )
+        return response.choices[0].message.content
+
+    def classify_batch(self, msgs, attempts=None) -> list[EnrichmentUpdate]:
+        # Messages the model leaves out (or mislabels) stay unenriched for the next pass
+        ids = {msg["id"] for msg in msgs}
+        for attempt in range(attempts or self.attempts):
+            try:
+                batch = BatchLabels.parse_raw(self._complete(msgs))
+                return [labels.dict() for labels in batch.labels if labels.id in ids]
+            except (ValidationError, json.JSONDecodeError) as e:
+                logging.warning(f"Invalid labels for batch of {len(msgs)} (attempt {attempt + 1}): {e}")
+        return []
+
+    def process_batch(self, msgs):
+        updates = []
+        claim_tokens = {msg["id"]: msg.get("claim_token") for msg in msgs}
+        try:
+            # Trivial and already-seen messages are labelled locally; only the rest go to the LLM
+            updates, to_classify = self.preclassifier.classify_many(msgs)
+            if to_classify:
+                llm_updates = self.classify_batch(to_classify)
+                by_id = {msg["id"]: msg for msg in to_classify}
+                self.preclassifier.remember_many([(by_id[labels["id"]], labels) for labels in llm_updates])
+                updates += llm_updates
+            # Fenced on our claims: labels for messages whose lease was lost are dropped
+            written = self.handler.update_msg_enrichment_many(
+                updates, ordered=False, claim_tokens=claim_tokens
+            ) if updates else []
+        except Exception as e:
+            logging.error(f"Batch of {len(msgs)} failed, releasing it: {e}")
+            written = []
+        if len(written) < len(updates):
+            logging.warning(f"Dropped {len(updates) - len(written)} labels whose claim was lost.")
+        # Anything not labelled goes back to the queue for another try (only while we still hold it)
+        labelled = set(written)
+        unlabelled = [msg["id"] for msg in msgs if msg["id"] not in labelled]
+        if unlabelled:
+            self.handler.release_messages(unlabelled, self.worker_id, set(claim_tokens.values()))
+        return len(written)
+
+    def run_once(self):
+        # One pass over up to concurrency * batch_size claimed messages; returns how many were labelled
+        msgs = self.scheduler.claim(self.worker_id, self.batch_size * self.concurrency, self.lease_seconds)
+        if not msgs:
+            return 0
+        batches = [msgs[i:i + self.batch_size] for i in range(0, len(msgs), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return sum(executor.map(self.process_batch, batches))
+
+    def run_forever(self, idle_sleep=5, metrics_interval=60):
+        last_metrics = 0
+        while True:
+            if time.monotonic() - last_metrics > metrics_interval:
+                for row in self.scheduler.metrics():
+                    logging.info(f"Backlog {row['vid_id']}{' (active)' if row['active'] else ''}: "
+                                 f"{row['pending']} pending, oldest {row['oldest_age_seconds'] or 0:.0f}s")
+                logging.info(f"Pre-classifier: {self.preclassifier.counters}, "
+                             f"{self.preclassifier.hit_rate():.0%} labelled without the LLM")
+                last_metrics = time.monotonic()
+            start = time.monotonic()
+            count = self.run_once()
+            if count:
+                elapsed = time.monotonic() - start
+                logging.info(f"Enriched {count} messages in {elapsed:.1f}s ({count / elapsed * 60:.0f} msgs/min).")
+            else:
+                time.sleep(idle_sleep)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Label unenriched chat messages with the LLM.")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--batch-size", type=int, default=20, help="Messages per LLM request")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM requests in flight")
+    parser.add_argument("--uri", default=None, help="MongoDB URI (defaults to the configured Atlas cluster)")
+    args = parser.parse_args()
+
+    worker = EnrichmentWorker(ChatMessagesHandler(uri=args.uri), model=args.model,
+                              batch_size=args.batch_size, concurrency=args.concurrency)
+    worker.run_forever()
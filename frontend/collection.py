@@ -1,10 +1,10 @@
 # from sql_table import insert_collection, stop_collection, get_collection, delete_collection
 import time
-from mongo_connect import ChatMessagesHandler
+from mongo_connect import get_shared_handler, parse_video_id
 import streamlit as st
 import pandas as pd
 
-handler = ChatMessagesHandler()
+handler = get_shared_handler()
 
 ss = st.session_state
 ss['collection_list'] = handler.get_collection()
@@ -13,7 +13,14 @@ ss['collection_list'] = [{k: v for k, v in d.items() if k != '_id'} for d in ss[
 
 # Collection_list into a dataframe
 df = pd.DataFrame(ss['collection_list'])
-df = pd.DataFrame([item.values() for item in ss['collection_list']], columns=["URL", "Platform", "Status"])
+# Per-stream counters come from the videos registry, one document per video
+video_stats = handler.get_video_stats()
+rows = []
+for item in ss['collection_list']:
+    stats = video_stats.get(parse_video_id(item.get("url")), {})
+    rows.append([item.get("url"), item.get("platform"), item.get("status"), stats.get("ingested", 0),
+                 stats.get("enriched", 0), stats.get("deleted", 0), stats.get("last_msg_time")])
+df = pd.DataFrame(rows, columns=["URL", "Platform", "Status", "Ingested", "Enriched", "Deleted", "Last message"])
 
 event = st.dataframe(df,
                     use_container_width=True,
@@ -47,11 +54,14 @@ else:
     ss['collection_select'] = None
 
 if insert_btn:
-    if handler.insert_collection(url):
-        st.write(f"Collection for {url} inserted and started.")
+    if parse_video_id(url) is None:
+        st.write(f"{url} is not a YouTube video URL.")
     else:
-        st.write(f"Collection for {url} already exists.")
-    st.rerun()
+        if handler.insert_collection(url):
+            st.write(f"Collection for {url} inserted and started.")
+        else:
+            st.write(f"Collection for {url} already exists.")
+        st.rerun()
 
 if start_btn:
     handler.start_collection(ss['collection_select'])
@@ -3,7 +3,7 @@ import streamlit as st
 import pandas as pd
 import time
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 import sqlite3
 import plotly.graph_objects as go
 import plotly.express as px
@@ -12,32 +12,25 @@ import pytz
 
 
 #from sql_table import collection_start_status, read_messages_from_db_enriched, read_messages_from_db
-from mongo_connect import ChatMessagesHandler
+from mongo_connect import get_shared_handler, PAGE_PROJECTION
+from live_store import LiveChangeCounter
+from preclassifier import record_corrections
 from streamlit_extras.metric_cards import style_metric_cards 
 
-handler = ChatMessagesHandler()
+handler = get_shared_handler()
 # Get list of active collection URLs
 urls = handler.collection_start_status()
 
 ss = st.session_state
 
-def create_stance_line_charts(enriched_msgs_df):
-    # Convert start_time and end_time to datetime objects if they're not already
-    start_time = enriched_msgs_df['Create DateTime'].min()
-    end_time = enriched_msgs_df['Create DateTime'].max()
-    
-    # Calculate time difference in minutes
-    time_diff = (end_time - start_time).total_seconds() / 60
-    
-    # Determine frequency based on time difference
-    if time_diff <= 15:
-        freq = '1min'
-    elif time_diff <= 60:
-        freq = '5min'
-    elif time_diff <= 120:
-        freq = '10min'
-    else:
-        freq = '15min'
+# Dashboard column -> backend field
+stance_fields = {'RnR': 'rnr', 'Military': 'mil', 'SG': 'sg', 'Societal Impact': 'societal_impact'}
+
+def create_stance_line_charts(metrics):
+    # Stance time series come pre-bucketed from handler.get_rollup_metrics
+    start_time = metrics['start']
+    end_time = metrics['end']
+    freq = metrics['freq']
     
     # List of stance variables
     stance_variables = ['RnR', 'Military', 'SG', 'Societal Impact']
@@ -48,12 +41,14 @@ def create_stance_line_charts(enriched_msgs_df):
     figures = {}
     
     for stance in stance_variables:
-        if stance not in enriched_msgs_df.columns:
-            print(f"Warning: {stance} column not found in the dataframe")
+        series = metrics['series'].get(stance_fields[stance])
+        if not series:
+            print(f"Warning: no {stance} stance data found")
             continue
         
-        # Group by time and stance, then count messages
-        df_grouped = enriched_msgs_df.groupby([pd.Grouper(key='Create DateTime', freq=freq), stance]).size().unstack(fill_value=0)
+        # Fill empty buckets with zero counts, as a time grouper would
+        df_grouped = pd.DataFrame(series).set_index('bucket')
+        df_grouped = df_grouped.reindex(pd.date_range(pd.Timestamp(start_time).floor(freq), end_time, freq=freq), fill_value=0)
 
         fig = go.Figure()
         
@@ -112,6 +107,36 @@ def create_stance_line_charts(enriched_msgs_df):
     return figures
 
 
+# Editable datasource columns -> backend fields
+fe_be_mapper = {
+    "Language": "lang",
+    "Sentiment": "senti",
+    "Military": "mil",
+    "RnR": "rnr",
+    "SG": "sg",
+    "Troll": "troll",
+    "Toxic": "toxic",
+    "Societal Impact": "societal_impact"
+}
+
+
+def edited_rows_patch(original_df, edited_rows):
+    # Turn st.data_editor's {row position: {column: value}} delta into
+    # [{"id": ..., <changed backend fields>}], skipping edits that were reverted.
+    # original_df must be the frame the editor was shown: positions are resolved to
+    # message IDs through its ID column.
+    patches = []
+    for row, changes in edited_rows.items():
+        if int(row) >= len(original_df):
+            continue
+        original = original_df.iloc[int(row)]
+        patch = {fe_be_mapper[col]: value for col, value in changes.items()
+                 if col in fe_be_mapper and original[col] != value}
+        if patch:
+            patches.append({"id": int(original['ID']), **patch})
+    return patches
+
+
 # Display the active collection URLs
 with st.sidebar:
     st.markdown("## Active Collection URLs:")
@@ -123,43 +148,55 @@ with st.sidebar:
             st.write(url)
 
 
-enriched_msgs = handler.read_messages_from_db_enriched()
-enriched_msgs = [{k: v for k, v in d.items() if k != '_id'} for d in enriched_msgs]
-
-enriched_msgs_df = pd.DataFrame(enriched_msgs)
-# Rename columns for consistency
-enriched_msgs_df.rename(columns={'id': 'ID',
-                                 'msg_id': 'Msg Id',
-                                    'vid_id': 'Video Id',
-                                    'author_id': 'Author Id',
-                                    'author': 'Author',
-                                    'dt_stamp': 'Create DateTime',
-                                    'message': 'Message',
-                                    'enriched': 'Enriched',
-                                    'mishap': 'Mishap',
-                                    'sg': 'SG',
-                                    'mil': 'Military',
-                                    'rnr': 'RnR',
-                                    'lang': 'Language',
-                                    'troll': 'Troll',
-                                    'toxic': 'Toxic',
-                                    'societal_impact': 'Societal Impact',
-                                    'senti': 'Sentiment'}, inplace=True)
-# enriched_msgs_df = pd.DataFrame(enriched_msgs, columns=['id', 'Video Id', 'Author', 'author_id', 'Create DateTime',
-#                                 'msg_id', 'Message', 'Enriched', 'Mishap', 'SG', 'Military', 'RnR', 'Language', 'Troll', 'Toxic', 'Sentiment'])
-
-# Convert Troll, Toxic and Enriched to boolean
-enriched_msgs_df['Troll'] = enriched_msgs_df['Troll'].astype(bool)
-enriched_msgs_df['Toxic'] = enriched_msgs_df['Toxic'].astype(bool)
-enriched_msgs_df['Enriched'] = enriched_msgs_df['Enriched'].astype(bool)
-enriched_msgs_df['Create DateTime'] = pd.to_datetime(enriched_msgs_df['Create DateTime'], errors='coerce')
+def to_enriched_frame(enriched_msgs):
+    enriched_msgs_df = pd.DataFrame(enriched_msgs, columns=[field for field in PAGE_PROJECTION if field != '_id'])
+    # Rename columns for consistency
+    enriched_msgs_df.rename(columns={'id': 'ID',
+                                     'msg_id': 'Msg Id',
+                                        'vid_id': 'Video Id',
+                                        'author_id': 'Author Id',
+                                        'author': 'Author',
+                                        'dt_stamp': 'Create DateTime',
+                                        'message': 'Message',
+                                        'enriched': 'Enriched',
+                                        'mishap': 'Mishap',
+                                        'sg': 'SG',
+                                        'mil': 'Military',
+                                        'rnr': 'RnR',
+                                        'lang': 'Language',
+                                        'troll': 'Troll',
+                                        'toxic': 'Toxic',
+                                        'societal_impact': 'Societal Impact',
+                                        'senti': 'Sentiment'}, inplace=True)
+
+    # Convert Troll, Toxic and Enriched to boolean
+    enriched_msgs_df['Troll'] = enriched_msgs_df['Troll'].astype(bool)
+    enriched_msgs_df['Toxic'] = enriched_msgs_df['Toxic'].astype(bool)
+    enriched_msgs_df['Enriched'] = enriched_msgs_df['Enriched'].astype(bool)
+    enriched_msgs_df['Create DateTime'] = pd.to_datetime(enriched_msgs_df['Create DateTime'], errors='coerce')
+    return enriched_msgs_df
+
+
+@st.cache_resource
+def get_live_changes():
+    # One watcher thread per server process, shared by every session
+    return LiveChangeCounter(get_shared_handler())
+
+
+live_changes = get_live_changes()
+
+
+# Version of the data this run shows, see auto_refresh below
+ss["changes_version"] = live_changes.version
 
 # Set the timezone to GMT+8
 timezone = pytz.timezone('Asia/Singapore')  # Singapore is in GMT+8
 
 st.markdown(f"## Dashboard (Last updated - {datetime.now(timezone).strftime('%H:%M:%S')})")
+# Counts and stance series come from the per-minute stats_rollup collection
+metrics = handler.get_rollup_metrics()
 # Group sentiments by sentiment type
-sentiments = enriched_msgs_df['Sentiment'].value_counts().to_dict()
+sentiments = metrics['counts']['senti']
 sentiments = {k.capitalize(): v for k, v in sentiments.items()}
 # Drop Na
 sentiments.pop('Na', None)
@@ -191,11 +228,11 @@ senti_fig.update_layout(
     margin=dict(l=0, r=0, t=30, b=0)  # Adjust margins as needed
 )
 
-troll = enriched_msgs_df['Troll'].value_counts().to_dict()
+troll = metrics['counts']['troll']
 # Capitalize the keys
 troll = {str(k).capitalize(): v for k, v in troll.items()}
 
-toxic = enriched_msgs_df['Toxic'].value_counts().to_dict()
+toxic = metrics['counts']['toxic']
 # Capitalize the keys
 toxic = {str(k).capitalize(): v for k, v in toxic.items()}
 
@@ -211,7 +248,7 @@ with col2:
     if troll_true == 0:
         st.metric(label="**Troll**🧌", value="Not Applicable")
     else:
-        st.metric(label="**Troll**🧌", value=f"{troll_true} of {len(enriched_msgs_df['Troll'])} ({round(troll_true / len(enriched_msgs_df['Troll']) * 100, 1)}%)")
+        st.metric(label="**Troll**🧌", value=f"{troll_true} of {metrics['total']} ({round(troll_true / metrics['total'] * 100, 1)}%)")
 with col3:
     st.write("")
     toxic_true = toxic.get('True', 0)
@@ -219,20 +256,20 @@ with col3:
         st.metric(label="**Toxic**💀", value="Not Applicable")
     else:
         st.metric(label="**Toxic**💀", 
-                  value=f"{toxic_true} of {len(enriched_msgs_df['Toxic'])} ({round(toxic_true / len(enriched_msgs_df['Toxic']) * 100, 1)}%)",
+                  value=f"{toxic_true} of {metrics['total']} ({round(toxic_true / metrics['total'] * 100, 1)}%)",
                   help="Indicates if the comment contains harmful or inappropriate content.")
 style_metric_cards(box_shadow=False)
 
 
 
-stances_figs = create_stance_line_charts(enriched_msgs_df)
+stances_figs = create_stance_line_charts(metrics)
 col5, col6, col7, col8 = st.columns(4)
 stance_columns = [col5, col6, col7, col8]
 stance_map = {'RnR': 'Race and Religion', 'Military': 'Military', 'SG': 'Singapore', 'Societal Impact': 'Societal Impact'}
 for i, (stance, fig) in enumerate(stances_figs.items()):
     with stance_columns[i]:
         stance_norm = stance_map[stance]
-        stance_dict = enriched_msgs_df[stance].value_counts().to_dict()
+        stance_dict = metrics['counts'][stance_fields[stance]]
         favor = stance_dict.get('Favor', 0)
         against = stance_dict.get('Against', 0)
         neutral = stance_dict.get('Neutral', 0)
@@ -240,7 +277,7 @@ for i, (stance, fig) in enumerate(stances_figs.items()):
         st.plotly_chart(fig, use_container_width=True)
 
 # Calculate language distribution
-language_distribution = enriched_msgs_df['Language'].value_counts()
+language_distribution = pd.Series(metrics['counts']['lang'], dtype=int).sort_values(ascending=False)
 total_messages = language_distribution.sum()
 
 # Calculate percentages
@@ -278,9 +315,67 @@ lang_fig.update_layout(
 st.plotly_chart(lang_fig, use_container_width=True)
 
 
-not_enriched = handler.read_messages_from_db()
-st.markdown(f"#### Datasource ({len(not_enriched)} not enriched, {len(enriched_msgs)} enriched)", help = "Messages less than 5 characters are not enriched or displayed.")
+not_enriched_count = handler.count_messages_not_enriched()
+st.markdown(f"#### Datasource ({not_enriched_count} not enriched, {metrics['total']} enriched)", help = "Messages less than 5 characters are not enriched or displayed.")
+
+# Filters for the datasource table, applied in MongoDB
+label_filters = {
+    'Sentiment': ('senti', ['Pos', 'Neut', 'Neg']),
+    'Singapore': ('sg', ['Favor', 'Against', 'Neutral', 'NA']),
+    'Military': ('mil', ['Favor', 'Against', 'Neutral', 'NA']),
+    'Race and Religion': ('rnr', ['Favor', 'Against', 'Neutral', 'NA']),
+    'Societal Impact': ('societal_impact', ['Favor', 'Against', 'Neutral', 'NA']),
+    'Language': ('lang', ['EN', 'MS', 'ZH', 'TA', 'Other']),
+    'Troll': ('troll', [True]),
+    'Toxic': ('toxic', [True]),
+}
+time_ranges = {'All': None, 'Last 15 min': 15, 'Last hour': 60, 'Last 6 hours': 360, 'Last 24 hours': 1440}
+
+flt_col1, flt_col2, flt_col3, flt_col4, flt_col5 = st.columns([2, 1, 1, 1, 2])
+with flt_col1:
+    filter_videos = st.multiselect("Video", handler.get_video_ids(), key="filter_videos")
+with flt_col2:
+    filter_time = st.selectbox("Time range", list(time_ranges), key="filter_time")
+with flt_col3:
+    filter_label = st.selectbox("Label", ['Any'] + list(label_filters), key="filter_label")
+with flt_col4:
+    label_field, label_values = label_filters.get(filter_label, (None, []))
+    filter_value = st.selectbox("Value", label_values, key="filter_value", disabled=label_field is None)
+with flt_col5:
+    filter_search = st.text_input("Search messages", key="filter_search")
+
+page_size = 100
+page_filters = (tuple(filter_videos), filter_time, filter_label, filter_value, filter_search)
+if ss.get("page_filters") != page_filters:
+    # New filters start again from the first page
+    ss["page_filters"] = page_filters
+    ss["page_cursors"] = [None]
+
+# Per page/filter key, so pending edits don't carry over to other rows; the
+# generation moves on after an update so the editor starts clean
+editor_key = f"edited_df_{ss.get('editor_generation', 0)}_{len(ss['page_cursors'])}_{hash(page_filters)}"
+
+# edited_rows is keyed by row position, so while edits are pending the page is frozen:
+# re-querying would shift rows as new messages arrive (and reset the editor)
+frozen_page = ss.get("frozen_page")
+if frozen_page is not None and frozen_page["key"] == editor_key and ss.get(editor_key, {}).get("edited_rows"):
+    page_msgs, has_more = frozen_page["msgs"], frozen_page["has_more"]
+else:
+    start = None
+    if time_ranges[filter_time] is not None:
+        # Whole minutes, so sessions with the same filters share the cached page
+        start = (datetime.now() - timedelta(minutes=time_ranges[filter_time])).replace(second=0, microsecond=0)
+    page_msgs, has_more = handler.read_enriched_page(
+        page_size=page_size,
+        after=ss["page_cursors"][-1],
+        vid_ids=tuple(filter_videos),
+        start=start,
+        labels=((label_field, filter_value),) if label_field else None,
+        search=filter_search or None,
+    )
+    ss["frozen_page"] = {"key": editor_key, "msgs": page_msgs, "has_more": has_more}
 
+enriched_msgs_df = to_enriched_frame(page_msgs)
 # Drop msg_id column
 enriched_msgs_df.drop(columns=['Msg Id', 'Author Id'], inplace=True)
 
@@ -347,32 +442,38 @@ column_config = {
             required=True,
         ),
     }
-# Sort enriched_msgs_df by Create DateTime descending
-if not bool(ss.get("changed_rows", False)):
-    # enriched_msgs_df.sort_values(by='Create DateTime', ascending=False, inplace=True)
-    # Initialize a list to keep track of changed rows
-    ss["changed_rows"] = []
-
-
-
 edited_df = st.data_editor(enriched_msgs_df,
                 column_config=column_config,
-                key = "edited_df",
+                key = editor_key,
                 disabled=["ID", "Video Id", "Author", "Create DateTime", "Message", "Enriched"],
                 hide_index=True, 
                 use_container_width=True)
 
 
 
-# Iterate through the rows and compare
-for i in range(len(enriched_msgs_df)):
-    if not enriched_msgs_df.iloc[i].equals(edited_df.iloc[i]):
-        # Append the ID of the row to changed_rows
-        ss["changed_rows"].append(edited_df.iloc[i]['ID'])
+pg_col1, pg_col2, pg_col3 = st.columns([1, 1, 1])
+with pg_col1:
+    if st.button("First page", use_container_width=True, disabled=len(ss["page_cursors"]) == 1):
+        ss["page_cursors"] = [None]
+        st.rerun()
+with pg_col2:
+    if st.button("Previous page", use_container_width=True, disabled=len(ss["page_cursors"]) == 1):
+        ss["page_cursors"].pop()
+        st.rerun()
+with pg_col3:
+    if st.button("Next page", use_container_width=True, disabled=not has_more):
+        # Keyset cursor: (dt_stamp, id) of the last row on this page
+        ss["page_cursors"].append((page_msgs[-1]['dt_stamp'], page_msgs[-1]['id']))
+        st.rerun()
+st.caption(f"Page {len(ss['page_cursors'])}")
+
+# Minimal per-ID patches from the editor's own edited_rows delta, resolved against
+# the (frozen) rows the editor was shown
+ss["changed_rows"] = edited_rows_patch(enriched_msgs_df, ss[editor_key]["edited_rows"])
 
 ds_col1, ds_blank, ds_col2 = st.columns([1, 1, 1])
 with ds_col1:
-    auto_refresh_toggle = st.toggle("Auto Refresh", not bool(ss.get("changed_rows")), help = "Automatically refresh the page every 30 seconds to fetch new data.")
+    auto_refresh_toggle = st.toggle("Auto Refresh", not bool(ss.get("changed_rows")), help = "Automatically refresh the page as new data arrives.")
 with ds_col2:
     update_btn = st.button("Update", key="update_btn", use_container_width=True, type="primary")
 
@@ -380,30 +481,13 @@ with ds_col2:
 
 if update_btn:
     st.write("Updating the database...")
-    enriched_msgs_list = []
-    ss["changed_rows"] = list(set(ss["changed_rows"]))
-    # Update the database with the changed rows
-    fe_be_mapper = {
-        "ID": "id",
-        "Language": "lang",
-        "Sentiment": "senti",
-        "Military": "mil",
-        "RnR": "rnr",
-        "SG": "sg",
-        "Troll": "troll",
-        "Toxic": "toxic",
-        "Societal Impact": "societal_impact"
-    }
-    for idx in ss["changed_rows"]:
-        edited_msg_dict = edited_df.loc[edited_df['ID'] == idx].to_dict('records')[0]
-        # Map frontend column names to backend column names (Drop columns not in the mapper)
-        edited_msg_dict = {k: v for k, v in edited_msg_dict.items() if k in fe_be_mapper.keys()}
-        # Rename columns
-        edited_msg_dict = {fe_be_mapper[k]: v for k, v in edited_msg_dict.items()}
-        enriched_msgs_list.append(edited_msg_dict)
-    
-    handler.update_msg_enrichment_many(enriched_msgs_list)
+    handler.update_msg_enrichment_many(ss["changed_rows"])
+    # Corrections also become the cached labels for identical messages
+    record_corrections(handler, [patch["id"] for patch in ss["changed_rows"]])
     ss['changed_rows_success'] = True
+    # Fresh editor and a fresh query on the next run
+    ss['editor_generation'] = ss.get('editor_generation', 0) + 1
+    ss.pop('frozen_page', None)
 
 
 if ss.get("changed_rows_success", False):
@@ -415,7 +499,14 @@ if ss.get("changed_rows_success", False):
     st.rerun()
     
 
+@st.fragment(run_every=1)
+def auto_refresh():
+    # Rerun the page when enriched messages changed since this run. The version moves
+    # at most once a second and the page's reads are shared through the handler's
+    # read cache, so sessions re-query at most once per change tick between them.
+    if live_changes.version != ss.get("changes_version"):
+        st.rerun()
+
+
 if auto_refresh_toggle:
-    time.sleep(30)
-    st.cache_data.clear()
-    st.rerun()
+    auto_refresh()
@@ -14,7 +14,9 @@ import os
 from configparser import ConfigParser
 import streamlit as st
 import copy
-from mongo_connect import ChatMessagesHandler
+import itertools
+from mongo_connect import get_shared_handler
+from summariser import fold_instruction, messages_to_fold, pack_messages, summarise_concurrently, summary_cache_key
 import pytz
 
 
@@ -32,54 +34,7 @@ except:
 
 client = OpenAI(api_key=api_key, max_retries=5)
 
-default_system_messages = f"""You are a helpful assistant in summarising comments and extract the key essence of the narrative, keep it short and concise. 
-
-Provide your summary in a short paragraphs and bold on the key themes."""
-
-# Define a 'chat' function that uses the OpenAI API to generate a response
-
-
-@backoff.on_exception(backoff.expo, APIConnectionError, max_time=1000)
-@backoff.on_exception(backoff.expo, RateLimitError, max_time=6000)
-def chat(prompt: str, openai_client=client, system_message=default_system_messages, model="gpt-4o", temperature=0, max_tokens=500):
-    """
-    Function that uses the OpenAI API to generate a response.
-
-    Args:
-    - history (list[dict[str, str]]): List of previous messages in the conversation.
-    - new_input (dict): Dictionary containing the new message to be added to the conversation.
-    - temperature (float): Controls the "creativity" of the response generated by the model.
-    - max_tokens (int): Maximum number of tokens (words) in the response generated by the model.
-    - exclude_functions (list[str]): List of function names to exclude from the response.
-
-    Returns:
-    - response.choices[0] (dict): Dictionary containing the response generated by the model.
-    """
-    # Generate a response using the OpenAI API
-    response = openai_client.chat.completions.create(
-        model=model, temperature=temperature, max_tokens=max_tokens,
-        messages=[
-            {
-                "role": "system",
-                "content": system_message
-            },
-            {
-                "role": "user",
-                "content": """Summarising the messages and extract the key essence of the narrative, keep it short and concise. 
-
-Provide your summary in a short paragraphs and bold on the key themes.\n\nMessages:\n""" + prompt
-            }
-        ]
-    )
-
-    # openai v1.0.0 > return the response in a pydantic model
-    # will need to dump the model into json str then load into json
-    response = json.loads(response.model_dump_json())
-
-    # Return the response generated by the model
-    return response["choices"][0]['message']['content']
-
-handler = ChatMessagesHandler()
+handler = get_shared_handler()
 
 ss = st.session_state
 # Custom CSS
@@ -103,6 +58,13 @@ with input_1:
     msg_threshold = st.slider("Select the number of messages to analyze", min_value=30, max_value=100, value=30, step=10, key="num_messages")
 with input_2:
     generate_summary = st.button("Generate Summary", use_container_width=True, type="primary", key="generate_summary")
+incremental = st.toggle("Incremental summaries", value=True, key="incremental",
+                        help="Fold only messages that arrived since the previous summary into it, regenerating from scratch every few updates.")
+
+# Incremental updates allowed before a summary is regenerated from scratch
+drift_limit = 5
+# Estimated prompt tokens spent on messages per summary
+token_budget = 3000
 
 
 mapped_section = {"sg": "Singapore", 
@@ -114,37 +76,78 @@ label_map = {"Favor": "Favor", "Against": "Against", "Pos": "Positive", "Neg": "
 if generate_summary:
     recent_msgs = handler.get_recent_message_breakdowns(int(msg_threshold))
     recent_msgs_updated = copy.deepcopy(recent_msgs)
+    # Lay out every section first, keeping a placeholder per label to fill in
+    # as its summary comes back
+    prompts = {}
+    placeholders = {}
+    cache_keys = {}
+    # Incremental mode: {key: (chat kwargs, folds)} for buckets folded into their
+    # previous summary, and previous summaries reused as-is when nothing is new
+    folded = {}
+    unchanged = []
+    window_ids = {}
+    rolling = handler.get_rolling_summaries() if incremental else {}
+    pack_stats = {}
+    usage = {}
     for section, value in recent_msgs.items():
         with st.container(border=True):
             st.markdown(f"## {mapped_section[section]}")
             col_1, col_2 = st.columns(2, vertical_alignment='center')
             for label, messages in value.items():
-                messages = [msg['message'] for msg in messages]                 
-                if label in ['Favor', 'Pos'] and len(messages) >= msg_threshold:
-                    chat_summary = chat(str(messages))
-                    recent_msgs_updated[section][f'summary_{label}'] = chat_summary
-                    with col_1:
-                        st.markdown(f"""<div class="positive-container">
-
-##### {label_map[label]} Summary
-{chat_summary}
-</div>""", unsafe_allow_html=True)
-                elif label in ['Favor', 'Pos'] and len(messages) < msg_threshold:
-                    with col_1:
+                key = (section, label)
+                cache_keys[key] = summary_cache_key([msg['id'] for msg in messages])
+                window_ids[key] = [msg['id'] for msg in messages]
+                previous = rolling.get(key)
+                new_messages = messages_to_fold(messages, previous, drift_limit)
+                if new_messages is not messages:
+                    if new_messages:
+                        folded[key] = ({"instruction": fold_instruction.format(summary=previous["summary"])}, previous["folds"] + 1)
+                    else:
+                        unchanged.append((key, previous["summary"]))
+                messages = [msg['message'] for msg in messages]
+                col = col_1 if label in ['Favor', 'Pos'] else col_2
+                with col:
+                    if len(messages) >= msg_threshold:
+                        prompts[key], pack_stats[key] = pack_messages([msg['message'] for msg in new_messages], token_budget)
+                        placeholders[key] = st.empty()
+                        placeholders[key].write(f"Generating {label_map[label]} summary...")
+                    else:
                         st.write(f"Insufficient messages for {label_map[label]}, only {len(messages)} messages found.")
-                        
-                if label in ['Against', 'Neg'] and len(messages) >= msg_threshold:
-                    chat_summary = chat(str(messages))
-                    recent_msgs_updated[section][f'summary_{label}'] = chat_summary
-                    with col_2:
-                        st.markdown(f"""<div class="negative-container">
+
+    # Buckets with nothing new since their rolling summary reuse it as-is
+    unchanged = [(key, summary) for key, summary in unchanged if key in prompts]
+    unchanged_keys = {key for key, _ in unchanged}
+    prompts = {key: prompt for key, prompt in prompts.items() if key not in unchanged_keys}
+    # Buckets whose messages haven't changed reuse the cached summary (full regenerations only)
+    cached = handler.get_cached_summaries(cache_keys[key] for key in prompts if key not in folded)
+    cached_results = [(key, cached[cache_keys[key]]) for key in prompts if key not in folded and cache_keys[key] in cached]
+    prompts = {key: prompt for key, prompt in prompts.items() if key in folded or cache_keys[key] not in cached}
+
+    results = summarise_concurrently(prompts, client, chat_kwargs={key: kwargs for key, (kwargs, _) in folded.items()}, usage=usage)
+    for (section, label), chat_summary in itertools.chain(unchanged, cached_results, results):
+        key = (section, label)
+        if isinstance(chat_summary, Exception):
+            placeholders[key].write(f"Failed to generate {label_map[label]} summary: {chat_summary}")
+            continue
+        if key in prompts and key not in folded:
+            handler.cache_summary(cache_keys[key], chat_summary)
+        if incremental and key not in unchanged_keys:
+            handler.save_rolling_summary(section, label, chat_summary, window_ids[key], folded[key][1] if key in folded else 0)
+        recent_msgs_updated[section][f'summary_{label}'] = chat_summary
+        container_class = "positive-container" if label in ['Favor', 'Pos'] else "negative-container"
+        with placeholders[key].container():
+            st.markdown(f"""<div class="{container_class}">
 
 ##### {label_map[label]} Summary
 {chat_summary}
 </div>""", unsafe_allow_html=True)
-                elif label in ['Against', 'Neg'] and len(messages) < msg_threshold:
-                    with col_2:
-                        st.write(f"Insufficient messages for {label_map[label]}, only {len(messages)} messages found.")
+            stats = pack_stats[key]
+            caption = f"{stats['kept']} of {stats['messages']} messages ({stats['duplicates']} duplicates merged)"
+            if usage.get(key):
+                caption += f" · {usage[key]['prompt_tokens']} tokens in, {usage[key]['completion_tokens']} out"
+            else:
+                caption += " · reused, no tokens spent"
+            st.caption(caption)
 
     recent_msgs_updated['generate_dt'] = datetime.now(timezone)
     handler.insert_summaries(recent_msgs_updated)
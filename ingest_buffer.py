@@ -0,0 +1,256 @@
+from collections import deque
+from datetime import datetime as dt
+import glob
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+from mongo_connect import ChatMessagesHandler
+
+# Record header: payload length, 4 bytes big-endian
+RECORD_HEADER = struct.Struct(">I")
+
+
+def encode_record(batch):
+    payload = json.dumps(
+        [{**msg, "dt_stamp": msg["dt_stamp"].isoformat()} for msg in batch], ensure_ascii=False
+    ).encode("utf-8")
+    return RECORD_HEADER.pack(len(payload)) + payload
+
+
+def read_segment(path):
+    # Yields the batches in a segment file; a torn record at the end (crash mid-write) is skipped
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+            size = RECORD_HEADER.unpack(header)[0] if len(header) == RECORD_HEADER.size else None
+            payload = f.read(size) if size is not None else b""
+            if size is None or len(payload) < size:
+                logging.warning(f"Ignoring truncated record at the end of {path}.")
+                return
+            yield [{**msg, "dt_stamp": dt.fromisoformat(msg["dt_stamp"])} for msg in json.loads(payload)]
+
+
+class SpillingIngestBuffer:
+    """
+    Bounded buffer in front of ChatMessagesHandler.ingest_messages.
+
+    Submitted messages are held in memory (at most max_memory) and written in batches
+    of max_batch by a background thread. When memory is full or a write fails, batches
+    go to append-only segment files in spill_dir instead (length-prefixed JSON records,
+    fsynced), and the thread replays the segments in order once writes succeed again,
+    retrying every retry_interval seconds. Replaying a batch twice is harmless: the
+    copies are rejected as duplicates by msg_id_index.
+
+    A submit's on_commit callback runs once its messages are durable, i.e. written to
+    the database or fsynced to a segment. A record that keeps failing while the
+    database is reachable is moved to a quarantine file after max_attempts, so one bad
+    record can't hold up the messages behind it.
+    """
+
+    def __init__(self, handler: ChatMessagesHandler, spill_dir="spill", max_memory=10000, max_batch=500,
+                 flush_interval=0.5, retry_interval=5, segment_bytes=16 * 1024 * 1024, max_attempts=5):
+        self.handler = handler
+        self.spill_dir = spill_dir
+        self.max_memory = max_memory
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.segment_bytes = segment_bytes
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        # (messages, on_commit) per submit; memory_count is the number of messages
+        self.memory = deque()
+        self.memory_count = 0
+        self.healthy = True
+        self.attempts = {}
+        self.counters = {"submitted": 0, "inserted": 0, "duplicates": 0, "spilled": 0, "replayed": 0,
+                         "quarantined": 0}
+
+        # Segments left by a previous run are replayed like any other
+        os.makedirs(spill_dir, exist_ok=True)
+        self.segment = None
+        existing = self._segment_paths()
+        self.segment_seq = int(os.path.basename(existing[-1])[8:16]) + 1 if existing else 0
+        self.spilled_pending = sum(len(batch) for path in existing for batch in read_segment(path))
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ingest-buffer", daemon=True)
+        self._thread.start()
+
+    def submit(self, messages, on_commit=None):
+        # Never blocks on the database: goes to memory, or to disk when memory is full,
+        # writes are failing, or earlier messages are still waiting on disk
+        if not messages:
+            return
+        with self.lock:
+            self.counters["submitted"] += len(messages)
+            if self.healthy and not self.spilled_pending and self.memory_count + len(messages) <= self.max_memory:
+                self.memory.append((messages, on_commit))
+                self.memory_count += len(messages)
+                full = self.memory_count >= self.max_batch
+                spilled = False
+            else:
+                self._spill(messages)
+                full = False
+                spilled = True
+        if spilled:
+            self._committed([on_commit])
+        if full:
+            self.wakeup.set()
+
+    def pending(self):
+        # Messages accepted but not yet in the database
+        with self.lock:
+            return self.memory_count + self.spilled_pending
+
+    def close(self):
+        # Stops the writer; whatever is still in memory goes to disk for the next run
+        self._stop.set()
+        self.wakeup.set()
+        self._thread.join()
+        with self.lock:
+            entries = list(self.memory)
+            if entries:
+                self._spill([msg for messages, _ in entries for msg in messages])
+                self.memory.clear()
+                self.memory_count = 0
+            self._close_segment()
+        self._committed([on_commit for _, on_commit in entries])
+
+    def _committed(self, callbacks):
+        for on_commit in callbacks:
+            if on_commit is None:
+                continue
+            try:
+                on_commit()
+            except Exception as e:
+                logging.error(f"Ingest commit callback failed: {e}")
+
+    def _segment_paths(self):
+        return sorted(glob.glob(os.path.join(self.spill_dir, "segment-*.log")))
+
+    def _spill(self, batch):
+        # Caller holds self.lock
+        if self.segment is None:
+            path = os.path.join(self.spill_dir, f"segment-{self.segment_seq:08d}.log")
+            self.segment_seq += 1
+            self.segment = open(path, "ab")
+        self.segment.write(encode_record(batch))
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+        self.spilled_pending += len(batch)
+        self.counters["spilled"] += len(batch)
+        if self.segment.tell() >= self.segment_bytes:
+            self._close_segment()
+
+    def _close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def _quarantine(self, batch):
+        with open(os.path.join(self.spill_dir, "quarantine.log"), "ab") as f:
+            f.write(encode_record(batch))
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            self.counters["quarantined"] += len(batch)
+
+    def _write(self, batch):
+        counts = self.handler.ingest_messages(batch)
+        with self.lock:
+            self.counters["inserted"] += counts["inserted"]
+            self.counters["duplicates"] += counts["duplicates"]
+        return not counts["failed"]
+
+    def _reachable(self):
+        # Through the client behind handler.db, the one the writes actually go to
+        try:
+            self.handler.db.client.admin.command('ping')
+            return True
+        except Exception:
+            return False
+
+    def _drain_memory(self):
+        while True:
+            with self.lock:
+                if not self.memory:
+                    return True
+                entries = [self.memory.popleft()]
+                while self.memory and sum(len(messages) for messages, _ in entries) < self.max_batch:
+                    entries.append(self.memory.popleft())
+                batch = [msg for messages, _ in entries for msg in messages]
+                self.memory_count -= len(batch)
+            if not self._write(batch):
+                # Keep the order: the failed batch, then everything queued behind it
+                with self.lock:
+                    self.healthy = False
+                    entries += list(self.memory)
+                    self._spill([msg for messages, _ in entries for msg in messages])
+                    self.memory.clear()
+                    self.memory_count = 0
+                self._committed([on_commit for _, on_commit in entries])
+                return False
+            self._committed([on_commit for _, on_commit in entries])
+
+    def _replay_segments(self):
+        while True:
+            with self.lock:
+                paths = self._segment_paths()
+                if not paths:
+                    return True
+                if self.segment is not None and self.segment.name == paths[0]:
+                    # Later spills go to a new segment while this one is replayed
+                    self._close_segment()
+            total = 0
+            quarantined = 0
+            for index, batch in enumerate(read_segment(paths[0])):
+                if not self._write(batch):
+                    if not self._reachable():
+                        # Outage: the segment stays; its written prefix comes back as duplicates next time
+                        with self.lock:
+                            self.healthy = False
+                        return False
+                    # The database is up but rejects this record
+                    key = (paths[0], index)
+                    self.attempts[key] = self.attempts.get(key, 0) + 1
+                    if self.attempts[key] < self.max_attempts:
+                        return False
+                    logging.error(f"Quarantining {len(batch)} messages from {paths[0]} after "
+                                  f"{self.max_attempts} failed writes.")
+                    self._quarantine(batch)
+                    quarantined += len(batch)
+                total += len(batch)
+            os.remove(paths[0])
+            self.attempts = {key: n for key, n in self.attempts.items() if key[0] != paths[0]}
+            with self.lock:
+                self.spilled_pending -= total
+                self.counters["replayed"] += total - quarantined
+
+    def _run(self):
+        next_attempt = 0
+        while not self._stop.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if time.monotonic() < next_attempt:
+                continue
+            try:
+                ok = self._drain_memory() and self._replay_segments()
+            except Exception as e:
+                logging.error(f"Ingest buffer flush failed: {e}")
+                ok = False
+            if ok:
+                with self.lock:
+                    if not self.healthy:
+                        logging.info(f"Database writes recovered, {self.counters['replayed']} spilled messages replayed so far.")
+                    self.healthy = True
+            else:
+                logging.warning(f"Database writes failing, {self.pending()} messages buffered; retrying in {self.retry_interval}s.")
+                next_attempt = time.monotonic() + self.retry_interval
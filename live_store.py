@@ -0,0 +1,94 @@
+from pymongo.errors import OperationFailure, PyMongoError
+import logging
+import threading
+import time
+
+from mongo_connect import ChatMessagesHandler
+
+
+class LiveChangeCounter:
+    """
+    Tells readers when enriched messages changed, without holding any messages.
+
+    A background thread follows a MongoDB change stream on `messages`, filtered on
+    the server to label writes and deletions (both stamp dt_enriched); lease claims
+    and inserts never reach the process. On a standalone server (no change streams)
+    it polls read_messages_enriched_since for ids and stamps only.
+
+    Changes are coalesced into ticks of tick_seconds: a tick with changes bumps
+    `version` and drops the handler's cached "messages" reads, so every session
+    sharing the handler re-reads once per tick at most and then shares the result.
+    Freshness: a label write is reflected in `version` within tick_seconds plus
+    change stream latency (well under a second), or within poll_interval plus
+    tick_seconds when polling. A reader checking `version` every second, like the
+    dashboard, therefore shows a write within about 2 s (4 s when polling).
+    """
+
+    def __init__(self, handler: ChatMessagesHandler, poll_interval=2, lag_seconds=5, tick_seconds=1):
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.lag_seconds = lag_seconds
+        self.tick_seconds = tick_seconds
+        self.lock = threading.Lock()
+        self.version = 0
+        self._changed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="live-change-counter", daemon=True)
+        self._thread.start()
+        self._ticker = threading.Thread(target=self._tick, name="live-change-ticker", daemon=True)
+        self._ticker.start()
+
+    def _bump(self):
+        self._changed.set()
+
+    def _tick(self):
+        while True:
+            self._changed.wait()
+            time.sleep(self.tick_seconds)
+            self._changed.clear()
+            self.handler.invalidate_cache("messages")
+            with self.lock:
+                self.version += 1
+
+    def _run(self):
+        while True:
+            try:
+                self._watch()
+            except OperationFailure as e:
+                # Standalone servers don't support change streams (code 40573)
+                logging.info(f"Change streams unavailable ({e}), polling every {self.poll_interval}s instead.")
+                self._poll()
+            except PyMongoError as e:
+                logging.error(f"Change stream interrupted: {e}")
+                time.sleep(self.poll_interval)
+
+    def _watch(self):
+        pipeline = [
+            {"$match": {
+                "operationType": "update",
+                "updateDescription.updatedFields.dt_enriched": {"$exists": True}
+            }},
+            {"$project": {"_id": 1}}
+        ]
+        with self.handler.db.messages.watch(pipeline) as stream:
+            # Anything written before the stream opened is already on screen
+            for _ in stream:
+                self._bump()
+
+    def _poll(self):
+        watermark = None
+        # (id, dt_enriched) read last time; each poll re-reads the lag window behind the watermark
+        seen = None
+        while True:
+            try:
+                if watermark is None:
+                    watermark = self.handler.get_enriched_watermark()
+                msgs, watermark = self.handler.read_messages_enriched_since(
+                    watermark, self.lag_seconds, projection={"_id": 0, "id": 1, "dt_enriched": 1}
+                )
+                stamps = {(msg["id"], msg["dt_enriched"]) for msg in msgs}
+                if seen is not None and stamps - seen:
+                    self._bump()
+                seen = stamps
+            except PyMongoError as e:
+                logging.error(f"Polling for enriched messages failed: {e}")
+            time.sleep(self.poll_interval)
@@ -0,0 +1,65 @@
+"""
+Maintenance commands for an existing chat_messages database.
+
+    python migrate.py msg-len      # backfill msg_len/eligible and build compound indexes
+    python migrate.py explain      # show winning plan stages for the main queries
+    python migrate.py rollup       # rebuild the stats_rollup collection from messages
+    python migrate.py rollup-check # compare stats_rollup with a full aggregation of messages
+    python migrate.py delete-flag  # write delete: False on messages without it and rebuild indexes
+    python migrate.py videos       # rebuild the videos registry counters from messages
+"""
+import argparse
+
+from mongo_connect import ChatMessagesHandler
+
+
+def msg_len(handler, args):
+    handler.backfill_msg_len()
+    handler.ensure_msg_indexes()
+
+
+def explain(handler, args):
+    for name, stages in handler.explain_message_queries().items():
+        scan = "COLLSCAN" if "COLLSCAN" in stages else "IXSCAN"
+        print(f"{name:<14} {scan:<9} {' <- '.join(stages)}")
+
+
+def rollup(handler, args):
+    handler.rebuild_stats_rollup()
+
+
+def rollup_check(handler, args):
+    diffs = handler.check_stats_rollup()
+    for counter, (rollup, messages) in sorted(diffs.items()):
+        print(f"{counter:<30} rollup {rollup:<8} messages {messages}")
+    print("stats_rollup matches messages." if not diffs else
+          f"{len(diffs)} counters differ; run `python migrate.py rollup` to rebuild.")
+
+
+def delete_flag(handler, args):
+    handler.backfill_delete_flag()
+    handler.ensure_msg_indexes()
+
+
+def videos(handler, args):
+    handler.rebuild_video_registry()
+
+
+commands = {
+    "msg-len": msg_len,
+    "explain": explain,
+    "rollup": rollup,
+    "rollup-check": rollup_check,
+    "delete-flag": delete_flag,
+    "videos": videos,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=commands.keys())
+    parser.add_argument("--uri", default=None, help="MongoDB URI (defaults to the configured Atlas cluster)")
+    args = parser.parse_args()
+
+    handler = ChatMessagesHandler(uri=args.uri)
+    commands[args.command](handler, args)
@@ -0,0 +1,187 @@
+from collections import OrderedDict
+import re
+import threading
+import time
+from typing import Optional
+
+from mongo_connect import ChatMessagesHandler, EnrichmentUpdate, METRIC_FIELDS
+
+# Common Malay function words, enough to tell Malay from English in short chat lines
+MALAY_WORDS = {
+    "saya", "aku", "kita", "kami", "awak", "dia", "mereka", "ini", "itu", "dan", "yang", "tak", "tidak",
+    "ada", "nak", "boleh", "dengan", "untuk", "dari", "pada", "sudah", "dah", "belum", "lagi", "apa",
+    "kenapa", "macam", "mana", "sini", "sana", "juga", "kalau", "tapi", "sangat", "betul", "semua",
+    "orang", "kerajaan", "negara", "terima", "kasih", "selamat", "pagi", "petang", "malam", "khabar",
+    "baik", "lah", "pun", "je", "jer", "ni", "tu", "ke", "la", "kan", "bang", "abang", "kakak",
+}
+
+# Whole messages made only of these are greetings/laughter: neutral, no stance
+TRIVIAL_PHRASES = [
+    r"h+i+", r"h+e+l+o+", r"h+e+y+", r"yo+", r"good (morning|afternoon|evening|night)", r"morning",
+    r"selamat (pagi|petang|malam)", r"apa khabar", r"vanakkam", r"வணக்கம்",
+    r"l+o+l+", r"(lo)+l*", r"lmf?ao+", r"rofl", r"(ha)+h?", r"(he)+h?", r"(hi)+h?", r"(wk)+", r"xd+",
+    r"哈+", r"呵+", r"你好", r"大家好", r"早上好", r"晚上好",
+    r"(everyone|everybody|all|guys|semua|bro|sis|sir)",
+    r"first", r"nice", r"wow", r"ok(ay)?", r"thanks?( you)?", r"thank you",
+]
+TRIVIAL_RE = re.compile(r"^(?:(?:" + "|".join(TRIVIAL_PHRASES) + r")\s*)+$")
+
+# YouTube emoji shortcodes, e.g. :face-blue-smiling:
+SHORTCODE_RE = re.compile(r":[\w-]+:")
+
+
+def normalise_text(text: str):
+    # "LOOOL!!!", "lol" and " Lol " collapse to the same key
+    text = re.sub(r'(.)\1{2,}', r'\1', SHORTCODE_RE.sub(" ", text).lower())
+    return re.sub(r'[\W_]+', ' ', text).strip()
+
+
+def detect_language(text: str):
+    # Script-based for Chinese and Tamil, lexicon-based for Malay vs English
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return "Other"
+    zh = sum(1 for ch in letters if '\u3400' <= ch <= '\u9fff')
+    ta = sum(1 for ch in letters if '\u0b80' <= ch <= '\u0bff')
+    if zh / len(letters) >= 0.5:
+        return "ZH"
+    if ta / len(letters) >= 0.5:
+        return "TA"
+    if sum(1 for ch in letters if ch.isascii()) / len(letters) < 0.5:
+        return "Other"
+    words = re.findall(r"[a-z]+", text.lower())
+    if words and sum(1 for word in words if word in MALAY_WORDS) / len(words) >= 0.3:
+        return "MS"
+    return "EN"
+
+
+def neutral_labels(id: int, lang: str) -> EnrichmentUpdate:
+    return {
+        "id": id,
+        "sg": "NA",
+        "mil": "NA",
+        "rnr": "NA",
+        "lang": lang,
+        "troll": False,
+        "toxic": False,
+        "senti": "Neut",
+        "societal_impact": "NA",
+    }
+
+
+class PreClassifier:
+    """
+    Cheap local stage in front of the LLM. Labels a message without an API call
+    when it is emoji/punctuation only, a pure greeting or laughter, or a
+    (near-)duplicate of a message labelled earlier; otherwise leaves it for the LLM.
+
+    Earlier labels live in the label_cache collection (shared by all workers, and
+    updated by manual corrections in the dashboard) with an in-memory LRU in front.
+    Memory entries expire after memory_ttl seconds so corrections made elsewhere
+    are picked up.
+    """
+
+    def __init__(self, handler: ChatMessagesHandler = None, max_entries=50000, memory_ttl=300):
+        self.handler = handler
+        self.max_entries = max_entries
+        self.memory_ttl = memory_ttl
+        self.lock = threading.Lock()
+        self.labels = OrderedDict()
+        self.counters = {"seen": 0, "rule": 0, "duplicate": 0, "llm": 0}
+
+    def _from_memory(self, key):
+        with self.lock:
+            entry = self.labels.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self.labels.move_to_end(key)
+            return entry[1]
+
+    def _to_memory(self, key, labels):
+        with self.lock:
+            self.labels[key] = (time.monotonic() + self.memory_ttl, {k: v for k, v in labels.items() if k != "id"})
+            self.labels.move_to_end(key)
+            while len(self.labels) > self.max_entries:
+                self.labels.popitem(last=False)
+
+    def _local(self, msg) -> Optional[EnrichmentUpdate]:
+        text = msg["message"] or ""
+        key = normalise_text(text)
+        labels = self._from_memory(key)
+        if labels is not None:
+            self._count("duplicate")
+            return {**labels, "id": msg["id"]}
+        if not key or TRIVIAL_RE.match(key):
+            self._count("rule")
+            return neutral_labels(msg["id"], detect_language(SHORTCODE_RE.sub(" ", text)))
+        return None
+
+    def _count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] += n
+
+    def classify(self, msg) -> Optional[EnrichmentUpdate]:
+        # Single message, local checks only
+        self._count("seen")
+        labels = self._local(msg)
+        if labels is None:
+            self._count("llm")
+        return labels
+
+    def classify_many(self, msgs):
+        # Returns (labels for the messages handled without the LLM, messages left for it),
+        # looking up the ones not known locally in label_cache with one query
+        self._count("seen", len(msgs))
+        updates = []
+        remaining = []
+        for msg in msgs:
+            labels = self._local(msg)
+            if labels is not None:
+                updates.append(labels)
+            else:
+                remaining.append(msg)
+
+        if remaining and self.handler is not None:
+            cached = self.handler.get_cached_labels({normalise_text(msg["message"] or "") for msg in remaining})
+            still_remaining = []
+            for msg in remaining:
+                key = normalise_text(msg["message"] or "")
+                if key in cached:
+                    self._to_memory(key, cached[key])
+                    updates.append({**cached[key], "id": msg["id"]})
+                    self._count("duplicate")
+                else:
+                    still_remaining.append(msg)
+            remaining = still_remaining
+
+        self._count("llm", len(remaining))
+        return updates, remaining
+
+    def remember(self, msg, labels: EnrichmentUpdate):
+        self.remember_many([(msg, labels)])
+
+    def remember_many(self, pairs):
+        # Reuse LLM labels for later copies of the same text, here and in label_cache
+        entries = {}
+        for msg, labels in pairs:
+            key = normalise_text(msg["message"] or "")
+            if key:
+                self._to_memory(key, labels)
+                entries[key] = {k: v for k, v in labels.items() if k != "id"}
+        if entries and self.handler is not None:
+            self.handler.cache_labels(entries)
+
+    def hit_rate(self):
+        with self.lock:
+            seen = self.counters["seen"]
+            return (self.counters["rule"] + self.counters["duplicate"]) / seen if seen else 0.0
+
+
+def record_corrections(handler: ChatMessagesHandler, ids):
+    # After manual edits, make the corrected labels the cached labels for that text
+    entries = {}
+    for msg in handler.read_messages_by_ids(ids):
+        key = normalise_text(msg.get("message") or "")
+        if key:
+            entries[key] = {field: msg.get(field) for field in METRIC_FIELDS}
+    handler.cache_labels(entries, manual=True)
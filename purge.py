@@ -0,0 +1,46 @@
+"""
+Background purge of soft-deleted messages (delete: True, set by delete_collection).
+
+    python purge.py                  # hard-delete, at most 500 messages/s, forever
+    python purge.py --archive        # move them to messages_archive instead
+    python purge.py --once           # purge everything eligible now, then exit
+"""
+import argparse
+import logging
+import time
+
+from mongo_connect import ChatMessagesHandler
+
+
+def purge(handler: ChatMessagesHandler, batch_size=1000, rate=500, grace_seconds=3600, archive=False):
+    # Purge batches until none are left, sleeping between them to stay under `rate`
+    # messages/s so the purge doesn't compete with ingest for write capacity
+    total = 0
+    while True:
+        start = time.monotonic()
+        count = handler.purge_deleted_messages(batch_size, grace_seconds, archive)
+        if not count:
+            return total
+        total += count
+        time.sleep(max(0, count / rate - (time.monotonic() - start)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Messages per delete")
+    parser.add_argument("--rate", type=float, default=500, help="Maximum messages purged per second")
+    parser.add_argument("--grace", type=float, default=3600, help="Seconds a message stays soft-deleted before it is purged")
+    parser.add_argument("--archive", action="store_true", help="Move purged messages to messages_archive")
+    parser.add_argument("--interval", type=float, default=300, help="Seconds between purge passes")
+    parser.add_argument("--once", action="store_true", help="Run a single pass and exit")
+    parser.add_argument("--uri", default=None, help="MongoDB URI (defaults to the configured Atlas cluster)")
+    args = parser.parse_args()
+
+    handler = ChatMessagesHandler(uri=args.uri)
+    while True:
+        count = purge(handler, args.batch_size, args.rate, args.grace, args.archive)
+        if count:
+            logging.info(f"{'Archived' if args.archive else 'Purged'} {count} deleted messages.")
+        if args.once:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,216 @@
+"""
+Summary prompts and OpenAI calls for the Summary page (frontend/summarisation.py),
+kept free of Streamlit so they can be used and tested on their own.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import math
+import threading
+import time
+
+import backoff
+from openai import OpenAI, APIConnectionError, RateLimitError
+
+from preclassifier import normalise_text
+
+
+default_system_messages = f"""You are a helpful assistant in summarising comments and extract the key essence of the narrative, keep it short and concise. 
+
+Provide your summary in a short paragraphs and bold on the key themes."""
+
+default_instruction = """Summarising the messages and extract the key essence of the narrative, keep it short and concise. 
+
+Provide your summary in a short paragraphs and bold on the key themes.\n\nMessages:\n"""
+
+# Used to fold new messages into a previous summary (see the incremental mode below)
+fold_instruction = """Update the existing summary with the new messages below and extract the key essence of the narrative, keep it short and concise. 
+
+Provide your summary in a short paragraphs and bold on the key themes.\n\nExisting summary:\n{summary}\n\nNew messages:\n"""
+
+def chat_completion(prompt: str, openai_client: OpenAI, system_message=default_system_messages, model="gpt-4o", temperature=0, max_tokens=500, instruction=default_instruction, usage=None):
+    """
+    Function that uses the OpenAI API to generate a response.
+
+    Args:
+    - history (list[dict[str, str]]): List of previous messages in the conversation.
+    - new_input (dict): Dictionary containing the new message to be added to the conversation.
+    - temperature (float): Controls the "creativity" of the response generated by the model.
+    - max_tokens (int): Maximum number of tokens (words) in the response generated by the model.
+    - exclude_functions (list[str]): List of function names to exclude from the response.
+
+    Returns:
+    - response.choices[0] (dict): Dictionary containing the response generated by the model.
+    """
+    # Generate a response using the OpenAI API
+    response = openai_client.chat.completions.create(
+        model=model, temperature=temperature, max_tokens=max_tokens,
+        messages=[
+            {
+                "role": "system",
+                "content": system_message
+            },
+            {
+                "role": "user",
+                "content": instruction + prompt
+            }
+        ]
+    )
+
+    # openai v1.0.0 > return the response in a pydantic model
+    # will need to dump the model into json str then load into json
+    response = json.loads(response.model_dump_json())
+
+    # Report tokens in/out to the caller when asked for
+    if usage is not None and response.get("usage"):
+        usage["prompt_tokens"] = response["usage"]["prompt_tokens"]
+        usage["completion_tokens"] = response["usage"]["completion_tokens"]
+
+    # Return the response generated by the model
+    return response["choices"][0]['message']['content']
+
+
+# Retrying variant for one-off calls; concurrent callers go through summarise_concurrently
+chat = backoff.on_exception(backoff.expo, APIConnectionError, max_time=1000)(
+    backoff.on_exception(backoff.expo, RateLimitError, max_time=6000)(chat_completion)
+)
+
+
+class RateLimitGate:
+    # Backoff shared by all summary workers: a rate limit hit by one call pauses
+    # every call until the (Retry-After or exponential) delay has passed
+    def __init__(self, initial_delay=1, max_delay=60):
+        self.lock = threading.Lock()
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.delay = initial_delay
+        self.resume_at = 0
+
+    def wait(self):
+        while True:
+            with self.lock:
+                remaining = self.resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def hit(self, retry_after=None):
+        with self.lock:
+            delay = float(retry_after) if retry_after else self.delay
+            self.delay = min(self.delay * 2, self.max_delay)
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+    def ok(self):
+        with self.lock:
+            self.delay = self.initial_delay
+
+
+def gated_chat(prompt: str, gate: RateLimitGate, openai_client: OpenAI, timeout=60, max_attempts=5, **chat_kwargs):
+    # One summary with a per-call timeout, retrying through the shared gate
+    openai_client = openai_client.with_options(timeout=timeout, max_retries=0)
+    for attempt in range(max_attempts):
+        gate.wait()
+        try:
+            result = chat_completion(prompt, openai_client=openai_client, **chat_kwargs)
+            gate.ok()
+            return result
+        except RateLimitError as e:
+            if attempt == max_attempts - 1:
+                raise
+            gate.hit(e.response.headers.get("retry-after"))
+        except APIConnectionError:
+            # Includes timeouts
+            if attempt == max_attempts - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def estimate_tokens(text: str):
+    # Local estimate without a tokenizer dependency: ~4 characters per token for
+    # ASCII, and one token per non-ASCII character (CJK, Tamil, emoji...)
+    non_ascii = sum(1 for ch in text if ord(ch) > 0x7F)
+    return math.ceil((len(text) - non_ascii) / 4) + non_ascii
+
+
+def pack_messages(messages: list, token_budget=3000, max_message_chars=280):
+    """
+    Build the "Messages:" part of a summary prompt.
+
+    Near-identical messages are merged (with a repeat count), over-long ones are
+    truncated, and messages are added in the given order (newest first) until the
+    estimated token budget is used up.
+
+    Returns:
+    - prompt (str): One message per line.
+    - stats (dict): Messages in/kept, duplicates merged, truncated and estimated tokens.
+    """
+    counts = {}
+    unique = []
+    for message in messages:
+        key = normalise_text(message)
+        if key not in counts:
+            counts[key] = 0
+            unique.append((key, message))
+        counts[key] += 1
+
+    lines = []
+    tokens = 0
+    truncated = 0
+    for key, message in unique:
+        if len(message) > max_message_chars:
+            message = message[:max_message_chars] + "..."
+            truncated += 1
+        line = f"- {message}" + (f" (x{counts[key]})" if counts[key] > 1 else "")
+        line_tokens = estimate_tokens(line) + 1
+        if tokens + line_tokens > token_budget:
+            break
+        lines.append(line)
+        tokens += line_tokens
+
+    stats = {
+        "messages": len(messages),
+        "kept": len(lines),
+        "duplicates": len(messages) - len(unique),
+        "truncated": truncated,
+        "estimated_tokens": tokens
+    }
+    return "\n".join(lines), stats
+
+
+def messages_to_fold(messages: list, previous: dict, drift_limit=5):
+    # The messages to fold into a rolling summary (see save_rolling_summary): those not
+    # covered by it yet, matched by id rather than time since a message enriched late
+    # can be older than everything already summarised. Returns `messages` itself when
+    # the summary has to be regenerated: none yet, too many folds, saved before
+    # message_ids was tracked, or no overlap with the window (messages were missed).
+    if previous is None or previous["folds"] >= drift_limit or "message_ids" not in previous:
+        return messages
+    summarised = set(previous["message_ids"])
+    new_messages = [msg for msg in messages if msg['id'] not in summarised]
+    return new_messages if len(new_messages) < len(messages) else messages
+
+
+def summary_cache_key(message_ids, model="gpt-4o", system_message=default_system_messages):
+    # Same model, prompt and (ordered) messages -> same summary, so reuse it
+    payload = json.dumps([model, system_message, list(message_ids)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def summarise_concurrently(prompts: dict, openai_client: OpenAI, max_workers=4, timeout=60, chat_kwargs=None, usage=None):
+    # Run chat for {key: prompt} on a bounded thread pool and yield (key, summary or
+    # exception) as each one finishes, so the page can render results as they arrive.
+    # chat_kwargs optionally holds extra chat_completion arguments per key; usage, if
+    # given, is filled with {key: {"prompt_tokens", "completion_tokens"}}.
+    gate = RateLimitGate()
+    chat_kwargs = chat_kwargs or {}
+    usage = usage if usage is not None else {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(gated_chat, prompt, gate, openai_client, timeout, usage=usage.setdefault(key, {}), **chat_kwargs.get(key, {})): key
+            for key, prompt in prompts.items()
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], e
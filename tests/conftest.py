@@ -0,0 +1,62 @@
+import os
+import sys
+import uuid
+from datetime import datetime as dt, timedelta
+
+import pytest
+
+# Flat layout: the modules live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# These tests need a real mongod, e.g. `docker run -p 27017:27017 mongo`
+TEST_URI = os.environ.get("MONGODB_TEST_URI", "mongodb://localhost:27017")
+
+
+@pytest.fixture
+def db_name():
+    pymongo = pytest.importorskip("pymongo")
+    client = pymongo.MongoClient(TEST_URI, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"No mongod at {TEST_URI}")
+    name = f"chat_messages_test_{uuid.uuid4().hex[:8]}"
+    yield name
+    client.drop_database(name)
+    client.close()
+
+
+@pytest.fixture
+def make_handler(db_name):
+    # One handler per simulated process, all on the same throwaway database
+    from mongo_connect import ChatMessagesHandler
+    handlers = []
+
+    def make():
+        handler = ChatMessagesHandler(uri=TEST_URI)
+        handler.db = handler.client[db_name]
+        if not handlers:
+            handler.create_msg_index()
+        handlers.append(handler)
+        return handler
+
+    yield make
+    for handler in handlers:
+        handler.client.close()
+
+
+@pytest.fixture
+def handler(make_handler):
+    return make_handler()
+
+
+def make_messages(count, vid_id="testvid0001", text="message {i} about housing and transport policy"):
+    start = dt.now() - timedelta(minutes=1)
+    return [{
+        "vid_id": vid_id,
+        "author": f"viewer{i}",
+        "author_id": f"UC{i:06d}",
+        "dt_stamp": start + timedelta(milliseconds=i),
+        "msg_id": uuid.uuid4().hex,
+        "message": text.format(i=i),
+    } for i in range(count)]
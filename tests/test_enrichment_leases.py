@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import make_messages
+
+enrichment = pytest.importorskip("enrichment")
+
+
+class FakeLLM:
+    # Stands in for the OpenAI client: labels every message with `senti` and
+    # records which ids it was asked about
+    def __init__(self, senti="Pos", delay=0):
+        self.senti = senti
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.seen = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, **kwargs):
+        msgs = json.loads(messages[-1]["content"])
+        with self.lock:
+            self.seen += [msg["id"] for msg in msgs]
+        time.sleep(self.delay)
+        labels = [{"id": msg["id"], "sg": "NA", "mil": "NA", "rnr": "NA", "lang": "EN", "troll": False,
+                   "toxic": False, "senti": self.senti, "societal_impact": "NA"} for msg in msgs]
+        content = json.dumps({"labels": labels})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def make_worker(handler, llm, name, **kwargs):
+    worker = enrichment.EnrichmentWorker(handler, openai_client=llm, **kwargs)
+    worker.worker_id = name
+    return worker
+
+
+def rollup_total(handler):
+    return sum(doc.get("total", 0) for doc in handler.db.stats_rollup.find())
+
+
+def test_concurrent_workers_label_each_message_once(make_handler):
+    handler = make_handler()
+    handler.ingest_messages(make_messages(200))
+    llm = FakeLLM()
+    workers = [make_worker(make_handler(), llm, f"worker-{i}", batch_size=10, concurrency=2) for i in range(4)]
+
+    def drain(worker):
+        # Until nothing is left, including messages other workers hold
+        while True:
+            if not worker.run_once():
+                worker.handler.invalidate_cache("messages")
+                if not worker.handler.count_messages_not_enriched():
+                    return
+                time.sleep(0.05)
+
+    threads = [threading.Thread(target=drain, args=(worker,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+
+    assert handler.db.messages.count_documents({"enriched": False}) == 0
+    # Every message went to the LLM exactly once, and was counted once
+    assert set(Counter(llm.seen).values()) == {1}
+    assert len(llm.seen) == 200
+    assert handler.db.videos.find_one({"_id": "testvid0001"})["enriched"] == 200
+    assert rollup_total(handler) == 200
+
+
+def test_write_after_lost_lease_is_dropped(make_handler):
+    handler = make_handler()
+    handler.ingest_messages(make_messages(5))
+    slow = make_worker(make_handler(), FakeLLM(senti="Neg", delay=2.5), "slow", batch_size=5, concurrency=1,
+                       lease_seconds=1)
+    fast = make_worker(make_handler(), FakeLLM(senti="Pos"), "fast", batch_size=5, concurrency=1)
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("slow", slow.run_once()))
+    thread.start()
+    # Let the slow worker's lease expire, then re-claim and label the same messages
+    time.sleep(1.5)
+    assert fast.run_once() == 5
+    thread.join()
+
+    assert result["slow"] == 0
+    assert {msg["senti"] for msg in handler.db.messages.find()} == {"Pos"}
+    assert handler.db.videos.find_one({"_id": "testvid0001"})["enriched"] == 5
+    assert rollup_total(handler) == 5
+    assert not any("Neg" in doc.get("counts", {}).get("senti", {}) for doc in handler.db.stats_rollup.find())
@@ -0,0 +1,33 @@
+import time
+
+from conftest import make_messages
+
+
+def test_long_outage_spills_without_quarantine(handler, tmp_path):
+    # Same setup as benchmarks/outage.py: the handler points at a server nobody
+    # listens on for far longer than max_attempts retries take
+    from pymongo import MongoClient
+    from ingest_buffer import SpillingIngestBuffer
+
+    live_db = handler.db
+    dead_db = MongoClient("mongodb://localhost:1", serverSelectionTimeoutMS=100, connectTimeoutMS=100)[live_db.name]
+    buffer = SpillingIngestBuffer(handler, str(tmp_path), max_batch=50, flush_interval=0.05,
+                                  retry_interval=0.1, max_attempts=3)
+    msgs = make_messages(300)
+
+    buffer.submit(msgs[:100])
+    handler.db = dead_db
+    outage_end = time.monotonic() + 3
+    for i in range(100, 300, 50):
+        buffer.submit(msgs[i:i + 50])
+    time.sleep(max(0, outage_end - time.monotonic()))
+    handler.db = live_db
+
+    deadline = time.monotonic() + 30
+    while buffer.pending() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    buffer.close()
+
+    assert buffer.counters["quarantined"] == 0
+    assert not (tmp_path / "quarantine.log").exists()
+    assert live_db.messages.count_documents({"vid_id": "testvid0001"}) == 300
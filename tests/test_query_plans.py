@@ -0,0 +1,15 @@
+from conftest import make_messages
+
+
+def test_message_queries_use_indexes(handler):
+    for vid_id in ["testvid0001", "testvid0002", "testvid0003"]:
+        handler.ingest_messages(make_messages(300, vid_id=vid_id))
+    ids = [msg["id"] for msg in handler.db.messages.find({"vid_id": "testvid0001"}, {"id": 1}).limit(100)]
+    handler.update_msg_enrichment_many([{"id": id, "senti": "Pos"} for id in ids])
+
+    plans = handler.explain_message_queries(vid_ids=["testvid0001", "testvid0002"])
+
+    assert set(plans) == {"not_enriched", "enriched", "recent", "by_video", "purge"}
+    for name, stages in plans.items():
+        assert "COLLSCAN" not in stages, f"{name}: {stages}"
+        assert "IXSCAN" in stages, f"{name}: {stages}"
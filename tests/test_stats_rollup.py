@@ -0,0 +1,54 @@
+import threading
+from collections import Counter
+
+from conftest import make_messages
+
+
+def rollup_counts(handler, field):
+    counts = Counter()
+    for doc in handler.db.stats_rollup.find():
+        for label, n in doc.get("counts", {}).get(field, {}).items():
+            counts[label] += n
+    return +counts
+
+
+def test_racing_edits_keep_the_rollup_exact(make_handler):
+    # Several processes relabelling the same messages at once: every write is
+    # guarded on the labels it replaces, so the rollup matches the messages
+    handler = make_handler()
+    handler.ingest_messages(make_messages(50))
+    ids = [msg["id"] for msg in handler.db.messages.find({}, {"id": 1})]
+    editors = [make_handler() for _ in range(4)]
+
+    labels = ["Pos", "Neg", "Neu"]
+
+    def edit(editor, offset):
+        for i in range(10):
+            editor.update_msg_enrichment_many(
+                [{"id": id, "senti": labels[(offset + i + n) % 3]} for n, id in enumerate(ids)], ordered=False
+            )
+
+    threads = [threading.Thread(target=edit, args=(editor, i)) for i, editor in enumerate(editors)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stored = Counter(msg["senti"] for msg in handler.db.messages.find())
+    assert rollup_counts(handler, "senti") == stored
+    assert sum(doc.get("total", 0) for doc in handler.db.stats_rollup.find()) == 50
+    assert handler.db.messages.count_documents({}) == 50
+    assert handler.check_stats_rollup() == {}
+
+
+def test_fenced_write_without_claim_is_dropped(handler):
+    handler.ingest_messages(make_messages(3))
+    ids = [msg["id"] for msg in handler.db.messages.find({}, {"id": 1})]
+
+    written = handler.update_msg_enrichment_many(
+        [{"id": id, "senti": "Neg"} for id in ids], ordered=False, claim_tokens={id: "stale" for id in ids}
+    )
+
+    assert written == []
+    assert handler.db.messages.count_documents({"enriched": True}) == 0
+    assert handler.db.stats_rollup.count_documents({}) == 0
@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+openai = pytest.importorskip("openai")
+summariser = pytest.importorskip("summariser")
+
+# Seconds the stub takes to answer, standing in for model latency
+DELAY = 0.3
+
+
+class StubCompletions(BaseHTTPRequestHandler):
+    # Answers POST /v1/chat/completions like the OpenAI API, after DELAY seconds
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(DELAY)
+        payload = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": f"summary of {len(body['messages'][-1]['content'])} chars"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_client():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCompletions)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield openai.OpenAI(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1")
+    server.shutdown()
+    server.server_close()
+
+
+def timed_run(client, prompts, max_workers):
+    usage = {}
+    start = time.perf_counter()
+    results = dict(summariser.summarise_concurrently(prompts, client, max_workers=max_workers, usage=usage))
+    return time.perf_counter() - start, results, usage
+
+
+def test_concurrent_summaries_beat_serial_wall_clock(stub_client):
+    # Eight buckets, as on the Summary page: serial takes ~8 x DELAY, four workers ~2 x DELAY
+    prompts = {(section, label): f"- message about {section} ({label})"
+               for section in ["sg", "sentiment", "religion_race", "military"] for label in ["Favor", "Against"]}
+
+    serial, serial_results, _ = timed_run(stub_client, prompts, max_workers=1)
+    concurrent, results, usage = timed_run(stub_client, prompts, max_workers=4)
+
+    assert set(results) == set(prompts)
+    assert all(isinstance(summary, str) for summary in results.values())
+    assert results == serial_results
+    assert all(usage[key] == {"prompt_tokens": 10, "completion_tokens": 5} for key in prompts)
+    assert serial >= len(prompts) * DELAY
+    assert concurrent < serial / 2
+
+
+def test_late_enriched_message_is_folded_in():
+    # Newest first, as get_recent_message_breakdowns returns them; message 5 was
+    # enriched after the last summary although it is older than everything in it
+    window = [{"id": id, "message": f"message {id}"} for id in [12, 11, 10, 5]]
+    previous = {"summary": "earlier summary", "folds": 1, "message_ids": [12, 11, 10, 9]}
+
+    assert [msg["id"] for msg in summariser.messages_to_fold(window, previous)] == [5]
+
+
+def test_rolling_summary_regenerates_when_it_cannot_fold():
+    window = [{"id": id, "message": f"message {id}"} for id in [12, 11, 10]]
+
+    assert summariser.messages_to_fold(window, None) is window
+    assert summariser.messages_to_fold(window, {"folds": 5, "message_ids": [11]}, drift_limit=5) is window
+    # No overlap with the previous window: messages in between were never summarised
+    assert summariser.messages_to_fold(window, {"folds": 0, "message_ids": [3, 2, 1]}) is window
+    assert summariser.messages_to_fold(window, {"folds": 0, "message_ids": [12, 11, 10]}) == []